@@ -16,17 +16,19 @@ import pickle
 
 from tqdm.auto import tqdm
 
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-
 from async_spider import Async_Spider
-from autohome_model import Autohome_Model
-from autohome_font import Autohome_Font
+from autohome_spider import Autohome_Spider_Mixin
+from autohome_context import get_context
+# autohome_font 的matplotlib, fontTools 在识别时才导入
+from autohome_font import Autohome_Font, Ttf_Cache
 
 # %%
-class Autohome_BBS(Async_Spider):
+class Autohome_BBS(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_bbs'
+    # 帖子页面缓存1天
+    cache_ttls = {
+        r'https?://club\.autohome\.com\.cn/bbs/thread/': 86400,
+    }
 
     # 轻型卡车页面不在默认级别中
     def __init__(self,
@@ -43,12 +45,11 @@ class Autohome_BBS(Async_Spider):
         if backend is None:
             backend = 'matplotlib'
         self.backend = backend
+        # 按url和sha1保存下载过的ttf, 见Ttf_Cache
+        self.ttf_cache = Ttf_Cache()
         self.init_preparetion()
 
     def init_preparetion(self):
-        self.df_models = Autohome_Model(verbose=False).read_exist_data(
-            clipboard=False)
-
         self.url_bbs_homepage = 'https://club.autohome.com.cn/bbs/forum-c-%s-1.html'
 
         self.dirname_output_bbs = self.dirname_output.joinpath('bbs')
@@ -81,6 +82,10 @@ class Autohome_BBS(Async_Spider):
         for msg in msgs:
             print(msg)
 
+    @property
+    def df_models(self):
+        return get_context(self.dirname_output).df_models
+
     def get_post_model_by_model_id(self, model_id, opencsv=False):
         filename = self.dirname_post_model.joinpath('post_model_id_%s.pkl' %
                                                     model_id)
@@ -264,7 +269,7 @@ class Autohome_BBS(Async_Spider):
     def get_biz_by_url_biz(self, url_biz, recognize=True):
         url_biz = url_biz.replace('http://', 'https://')
         biz_id = self.regex_biz.match(url_biz).group(1)
-        response = self.session.get(url_biz)
+        response = self.session_get(url_biz)
 
         # if css_process is False:
         # 没有解析css文字混淆
@@ -287,7 +292,8 @@ class Autohome_BBS(Async_Spider):
         }
 
         if recognize:
-            af = Autohome_Font(backend=self.backend)
+            af = Autohome_Font(backend=self.backend,
+                               ttf_cache=self.ttf_cache)
             result = af.replace_biz_content(result)
 
         filename = self.dirname_biz.joinpath('%s.pkl' % biz_id)
@@ -333,7 +339,7 @@ class Autohome_BBS(Async_Spider):
         # 分页符
         if pages:
             responses = [
-                self.session.get(url_biz.replace('-1', '-%s' % page))
+                self.session_get(url_biz.replace('-1', '-%s' % page))
                 for page in pages
             ]
             df_replies = []
@@ -387,10 +393,15 @@ class Autohome_BBS(Async_Spider):
         return url_ttf
 
     def ttf_get_ttf(self, response):
+        # 下载过的url不再请求
         url_ttf = self.ttf_find_url(response)
+        ttf = self.ttf_cache.get_ttf_by_url(url_ttf)
+        if ttf is not None:
+            return ttf
         response_ttf = self.session.get(url_ttf)
         if response_ttf.status_code == 200:
             ttf = response_ttf.content
+            self.ttf_cache.put_ttf(url_ttf, ttf)
             return ttf
 
 # %%
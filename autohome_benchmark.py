@@ -0,0 +1,121 @@
+# %%[markdown]
+# 性能检查
+# - benchmark_startup: spider构造时间, 数据在第一次访问时才读取, 构造应接近0
+# - benchmark_import: python -X importtime, 检查模块导入时间及是否导入了重型依赖
+
+# %%
+import re
+import sys
+import time
+import importlib
+import subprocess
+
+modules_spider = [
+    'autohome_model',
+    'autohome_dealer',
+    'autohome_dealer_price',
+    'autohome_sale',
+    'autohome_configuration',
+    'autohome_bbs',
+    'autohome_new_car_calendar',
+    'autohome_newenergy',
+    'autohome_picture',
+    'autohome_font',
+]
+# 只在使用driver或font backend时导入
+modules_heavy = ['selenium', 'matplotlib', 'fontTools', 'PIL', 'baidu_orc']
+
+
+# %%
+def benchmark_startup(specs=None, repeat=3, verbose=True):
+    # specs: [(module_name, class_name, kwargs)]
+    # return {class_name: [seconds of each construction]}
+    if specs is None:
+        specs = [
+            ('autohome_model', 'Autohome_Model', {
+                'verbose': False
+            }),
+            ('autohome_dealer', 'Autohome_Dealer', {
+                'verbose': False
+            }),
+            ('autohome_dealer_price', 'Autohome_Dealer_Price', {}),
+            ('autohome_sale', 'Autohome_Sale', {}),
+            ('autohome_configuration', 'Autohome_Configuration', {}),
+            ('autohome_bbs', 'Autohome_BBS', {}),
+        ]
+    results = {}
+    for module_name, class_name, kwargs in specs:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        seconds = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            cls(**kwargs)
+            seconds.append(time.perf_counter() - t0)
+        results[class_name] = seconds
+        if verbose:
+            print('%s: first %.4fs, min %.4fs' %
+                  (class_name, seconds[0], min(seconds)))
+    return results
+
+
+def benchmark_import(modules=None, heavy=None, verbose=True):
+    # 每个模块单独子进程运行 python -X importtime -c "import module"
+    # return {module: {'seconds': 累计导入时间, 'heavy': 导入的重型依赖}}
+    if modules is None:
+        modules = modules_spider
+    if heavy is None:
+        heavy = modules_heavy
+    regex = re.compile(r'import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+    results = {}
+    for module in modules:
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import %s' % module],
+            capture_output=True,
+            text=True)
+        seconds = None
+        loaded = set()
+        for line in proc.stderr.splitlines():
+            m = regex.match(line)
+            if m is None:
+                continue
+            cumulative, name = int(m.group(2)), m.group(4)
+            if name.split('.')[0] in heavy:
+                loaded.add(name.split('.')[0])
+            if name == module:
+                seconds = cumulative / 1e6
+        results[module] = {
+            'seconds': seconds,
+            'heavy': sorted(loaded),
+            'returncode': proc.returncode,
+        }
+        if verbose:
+            print('%s: %ss, heavy imports: %s' %
+                  (module, seconds, results[module]['heavy']))
+    return results
+
+
+def check_import(modules=None, heavy=None, max_seconds=None):
+    # 回归检查: 导入成功且没有导入重型依赖
+    results = benchmark_import(modules, heavy, verbose=False)
+    for module, result in results.items():
+        assert result['returncode'] == 0, '%s import failed' % module
+        assert not result['heavy'], '%s imports %s' % (module,
+                                                       result['heavy'])
+        if max_seconds is not None:
+            assert result['seconds'] <= max_seconds, (
+                '%s imports in %ss' % (module, result['seconds']))
+    return results
+
+
+# %%
+# spider构造时间
+if __name__ == '__main__':
+    results = benchmark_startup()
+
+# %%
+# 模块导入时间
+if __name__ == '__main__':
+    results = benchmark_import()
+    check_import()
+# %%
@@ -0,0 +1,172 @@
+# %%[markdown]
+# http响应缓存
+# - 按sha1(url)分片保存: cache/ab/ab12...ef.pkl.gz, gzip压缩
+# - ttls: {url正则: 秒}, 第一个匹配的生效; 0 不缓存, None 永不过期
+#   没有匹配的url不缓存
+# - 未过期的缓存直接返回, 不访问网络
+# - 过期后带If-None-Match/If-Modified-Since请求, 304或请求失败时返回缓存
+
+# %%
+import os
+import re
+import json
+import gzip
+import time
+import pickle
+import hashlib
+import pathlib
+import tempfile
+from collections import Counter
+
+
+# %%
+class Cached_Response:
+    # 与response相同的常用属性: content, text, url, status_code, headers, meta, json()
+    from_cache = True
+
+    def __init__(self, entry, meta=None):
+        self.url = entry['url']
+        self.status_code = entry['status_code']
+        self.headers = entry['headers']
+        self.encoding = entry['encoding']
+        self.content = entry['content']
+        self.time = entry['time']
+        self.meta = meta
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+    def __repr__(self):
+        return '<Cached_Response [%s] %s>' % (self.status_code, self.url)
+
+
+class Response_Cache:
+    def __init__(self, dirname='output/cache', ttls=None, default_ttl=0):
+        self.dirname = pathlib.Path(dirname)
+        self.ttls = [(re.compile(pattern), ttl)
+                     for pattern, ttl in (ttls or {}).items()]
+        self.default_ttl = default_ttl
+        # hit, revalidated, stale, miss, stored
+        self.counts = Counter()
+
+    def get_ttl(self, url):
+        for regex, ttl in self.ttls:
+            if regex.match(url):
+                return ttl
+        return self.default_ttl
+
+    def is_cacheable(self, url):
+        return self.get_ttl(url) != 0
+
+    def get_filename(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.dirname.joinpath(key[:2], '%s.pkl.gz' % key)
+
+    def read(self, url):
+        filename = self.get_filename(url)
+        try:
+            with gzip.open(filename, 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, OSError, pickle.UnpicklingError):
+            return
+        # sha1冲突时不使用
+        if entry['request_url'] == url:
+            return entry
+
+    def write(self, url, entry):
+        # 先写临时文件再替换, 中断时不会留下损坏的缓存
+        filename = self.get_filename(url)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=filename.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                    pickle.dump(entry, gz, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def is_fresh(self, url, entry):
+        ttl = self.get_ttl(url)
+        return ttl is None or time.time() - entry['time'] < ttl
+
+    def get_header(self, headers, name):
+        name = name.lower()
+        for k, v in headers.items():
+            if k.lower() == name:
+                return v
+
+    def get_validators(self, entry):
+        # 条件请求headers
+        headers = {}
+        etag = self.get_header(entry['headers'], 'etag')
+        if etag:
+            headers['If-None-Match'] = etag
+        last_modified = self.get_header(entry['headers'], 'last-modified')
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def get(self, url, meta=None):
+        # return (缓存响应, 过期缓存, 条件请求headers)
+        # 缓存响应不为None时不需要请求
+        entry = self.read(url)
+        if entry is None:
+            self.counts['miss'] += 1
+            return None, None, {}
+        if self.is_fresh(url, entry):
+            self.counts['hit'] += 1
+            return Cached_Response(entry, meta=meta), entry, {}
+        return None, entry, self.get_validators(entry)
+
+    def update(self, url, entry, response, meta=None):
+        # entry: get返回的过期缓存
+        # return 请求的response, 或304/请求失败时的缓存响应
+        if response is None or response.status_code == 304:
+            if entry is None:
+                return response
+            if response is None:
+                self.counts['stale'] += 1
+            else:
+                # 304: 缓存仍然有效, 重新计时
+                self.counts['revalidated'] += 1
+                entry['time'] = time.time()
+                self.write(url, entry)
+            return Cached_Response(entry, meta=meta)
+        if response.status_code == 200:
+            self.counts['stored'] += 1
+            self.write(
+                url, {
+                    'request_url': url,
+                    'url': str(response.url),
+                    'status_code': response.status_code,
+                    'headers': dict(response.headers),
+                    'encoding': getattr(response, 'encoding', None),
+                    'content': response.content,
+                    'time': time.time(),
+                })
+        return response
+
+    def clear(self, url=None):
+        # url为None时清空所有缓存
+        if url is not None:
+            filename = self.get_filename(url)
+            if filename.exists():
+                filename.unlink()
+            return
+        for filename in self.dirname.glob('*/*.pkl.gz'):
+            filename.unlink()
+
+
+# %%
+if __name__ == '__main__':
+    self = Response_Cache(ttls={r'https://www\.autohome\.com\.cn/spec/': None})
+    url = 'https://www.autohome.com.cn/spec/1000/'
+    response, entry, headers = self.get(url)
+    print(response, self.get_filename(url), self.counts)
+# %%
@@ -0,0 +1,193 @@
+# %%[markdown]
+# 车型目录索引
+# - 由autohome_model_result.pkl, brand_dict, manu_dict, 省份城市pkl生成
+# - model, brand, manu, segment, province 双向查询: id <-> name
+# - 索引缓存在output/autohome_catalog_index.pkl, 源文件变化后自动重建
+
+# %%
+import os
+import pickle
+import pathlib
+
+import pandas as pd
+
+
+# %%
+class Autohome_Catalog:
+    name = 'autohome_catalog'
+    kinds = ['model', 'brand', 'manu', 'segment', 'province']
+
+    def __init__(self, dirname_output='output'):
+        self.dirname_output = pathlib.Path(dirname_output)
+        self.index_pkl = self.dirname_output.joinpath('%s_index.pkl' %
+                                                      self.name)
+        self.source_files = {
+            'model':
+            self.dirname_output.joinpath('autohome_model_result.pkl'),
+            'brand':
+            self.dirname_output.joinpath('autohome_model_brand_dict_pkl'),
+            'manu':
+            self.dirname_output.joinpath('autohome_model_manu_dict_pkl'),
+            'province':
+            self.dirname_output.joinpath(
+                'dealer', 'autohome_dealer_result_province_city.pkl'),
+        }
+        self.signature = None
+        self.index = None
+        self.load()
+
+    def get_signature(self):
+        # 源文件的(mtime, size), 不存在为None
+        signature = {}
+        for k, filename in self.source_files.items():
+            try:
+                stat = os.stat(filename)
+                signature[k] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature[k] = None
+        return signature
+
+    def is_valid(self):
+        return self.signature == self.get_signature()
+
+    def load(self):
+        # 优先读取缓存, 源文件变化时重建
+        signature = self.get_signature()
+        if self.index_pkl.exists():
+            with open(self.index_pkl, 'rb') as f:
+                cache = pickle.load(f)
+            if cache.get('signature') == signature:
+                self.signature = signature
+                self.index = cache['index']
+                return self.index
+        self.signature = signature
+        self.index = self.build_index()
+        if self.dirname_output.exists():
+            with open(self.index_pkl, 'wb') as f:
+                pickle.dump({
+                    'signature': self.signature,
+                    'index': self.index
+                }, f)
+        return self.index
+
+    def read_pickle(self, key):
+        filename = self.source_files[key]
+        if filename.exists():
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+
+    def build_index(self):
+        df_models = self.read_pickle('model')
+        if df_models is None:
+            df_models = pd.DataFrame(columns=[
+                'model_id', 'model_name', 'manu_id', 'manu_name', 'brand_id',
+                'brand_name', 'segment_id', 'segment_name'
+            ])
+        df_province_city = self.read_pickle('province')
+
+        id_to_name = {
+            kind: self.df_to_dict(df_models, '%s_id' % kind,
+                                  '%s_name' % kind)
+            for kind in ['model', 'brand', 'manu', 'segment']
+        }
+        if df_province_city is not None:
+            id_to_name['province'] = self.df_to_dict(df_province_city,
+                                                     'id_province',
+                                                     'name_province')
+        else:
+            id_to_name['province'] = {}
+
+        # 名称重复时保留第一个
+        name_to_id = {
+            kind: self.reverse_dict(d)
+            for kind, d in id_to_name.items()
+        }
+        # brand_dict, manu_dict 来自字母页面, 补充df_models中没有的id和名称
+        for kind in ['brand', 'manu']:
+            d = self.read_pickle(kind)
+            if d:
+                id_to_name[kind] = {**d, **id_to_name[kind]}
+                name_to_id[kind] = {
+                    **self.reverse_dict(d),
+                    **name_to_id[kind]
+                }
+
+        # model_id -> brand_id, manu_id, segment_id
+        df_model_attrs = df_models[[
+            'model_id', 'brand_id', 'manu_id', 'segment_id'
+        ]].drop_duplicates(subset=['model_id'], keep='first')
+        model_attrs = {
+            row[0]: {
+                'brand_id': row[1],
+                'manu_id': row[2],
+                'segment_id': row[3]
+            }
+            for row in df_model_attrs.values
+        }
+        # brand_id -> [manu_id]
+        brand_manu_ids = {}
+        for brand_id, manu_id in df_models[['brand_id', 'manu_id'
+                                            ]].drop_duplicates().values:
+            brand_manu_ids.setdefault(brand_id, []).append(manu_id)
+
+        index = {
+            'id_to_name': id_to_name,
+            'name_to_id': name_to_id,
+            'model_attrs': model_attrs,
+            'brand_manu_ids': brand_manu_ids,
+        }
+        return index
+
+    def df_to_dict(self, df, column_key, column_value):
+        df = df[[column_key, column_value]].dropna().drop_duplicates(
+            subset=[column_key], keep='first')
+        return {k: v for k, v in df.values}
+
+    def reverse_dict(self, d):
+        reverse = {}
+        for k, v in d.items():
+            reverse.setdefault(v, k)
+        return reverse
+
+    def get_dict(self, kind):
+        # 返回 {id: name}
+        return self.index['id_to_name'][kind]
+
+    def get_name(self, kind, key):
+        return self.index['id_to_name'][kind].get(key)
+
+    def get_id(self, kind, name):
+        return self.index['name_to_id'][kind].get(name)
+
+    def get_model_attr(self, model_id, attr='brand_id'):
+        # attr: 'brand_id', 'manu_id', 'segment_id'
+        attrs = self.index['model_attrs'].get(str(model_id))
+        if attrs:
+            return attrs[attr]
+
+    def get_manu_ids_by_brand_id(self, brand_id):
+        return self.index['brand_manu_ids'].get(brand_id, [])
+
+
+_catalogs = {}
+
+
+def get_catalog(dirname_output='output'):
+    # 进程内共享, 源文件变化时重建
+    key = pathlib.Path(dirname_output).resolve()
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = Autohome_Catalog(dirname_output)
+        _catalogs[key] = catalog
+    elif not catalog.is_valid():
+        catalog.load()
+    return catalog
+
+
+# %%
+if __name__ == '__main__':
+    self = get_catalog()
+    for kind in self.kinds:
+        print(kind, len(self.get_dict(kind)))
+    print(self.get_model_attr('3554', 'brand_id'))
+# %%
@@ -6,18 +6,57 @@
 import asyncio
 import re
 import json
+import time
+import random
+from collections import Counter
 
+import numpy as np
 import pandas as pd
 import bs4
 from functools import reduce
 
 from async_spider import Async_Spider
-from autohome_model import Autohome_Model
+from autohome_spider import Autohome_Spider_Mixin
+from autohome_context import get_context
+from autohome_js import Js_Runtime_Pool
+from autohome_store import Partitioned_Store, fingerprint_rows, atomic_write
+from autohome_encoding import encode_partitions, decode_frame, memory_report
+
+# %%
+# 配置页面一次扫描: config, option, keyLink 及css混淆js
+regex_page_vars = re.compile(
+    r'var (?P<var>config|option|keyLink) = (?P<value>.*);'
+    r'|(?P<js>\(function\([a-zA-Z]{2}.*?_\).*?\(document\);)')
+# css混淆占位符和&nbsp
+regex_placeholder = re.compile(r"<span class='[^']*'></span>|&nbsp")
+page_vars = ['config', 'option', 'keyLink']
+
+
+def fetch_page_vars(text):
+    # return {'config': str, 'option': str, 'keyLink': str, 'js': [str]}
+    # 同名var只保留第一个, 没有找到的var为None
+    result = {var: None for var in page_vars}
+    result['js'] = []
+    for m in regex_page_vars.finditer(text):
+        if m.group('js') is not None:
+            result['js'].append(m.group('js'))
+        elif result[m.group('var')] is None:
+            result[m.group('var')] = m.group('value')
+    return result
+
+
+def replace_placeholder(value, css_dict):
+    # css_dict: {"<span class='xx'></span>": 文字}, 没有的占位符保持不变
+    table = {**css_dict, '&nbsp': ' '}
+    return regex_placeholder.sub(lambda m: table.get(m.group(0), m.group(0)),
+                                 value)
 
 
 # %%
-class Autohome_Configuration(Async_Spider):
+class Autohome_Configuration(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_configuration'
+    # 请求失败(None)或以下状态码时重试
+    retry_status_codes = {429, 500, 502, 503, 504}
 
     # 轻型卡车页面不在默认级别中
     def __init__(
@@ -25,10 +64,14 @@ class Autohome_Configuration(Async_Spider):
         max_retry=3,
         concurrency=100,
         threading_init_driver=False,
+        js_workers=4,
     ):
         super().__init__(max_retry=max_retry,
                          concurrency=concurrency,
                          threading_init_driver=threading_init_driver)
+        # js_workers: 常驻node进程数, 0 使用js_return_var
+        self.js_workers = js_workers
+        self._js_pool = None
         self.init_preparetion()
 
     def init_preparetion(self):
@@ -39,19 +82,33 @@ class Autohome_Configuration(Async_Spider):
         self.url_test_nolaunch = 'https://car.autohome.com.cn/config/series/6100.html'
         self.url_test_stop = 'https://www.autohome.com.cn/874'
 
-        self.df_models = Autohome_Model(verbose=False).read_exist_data(
-            clipboard=False)
-
         # url停售款, {series_id}_{year_id}
         self.url_configuration_for_stop = 'https://car.autohome.com.cn/config/series/{series_id}-{year_id}.html'
 
+        # 旧版整体保存的结果, 第一次读取时迁移到self.store
         self.result_pkl = self.dirname_output.joinpath('%s_result_series.pkl' %
                                                        self.name)
         self.result_keylink_pkl = self.dirname_output.joinpath(
             '%s_result_keylink.pkl' % self.name)
+        # 按model_id分区保存, manifest中记录每个分区的spec_id及每行的fingerprint
+        self.store = Partitioned_Store(self.dirname_output.joinpath(
+            '%s_result' % self.name),
+                                       id_column=('spec_id', '', '', ''),
+                                       fingerprint=True)
+        # 变化记录, 每次运行一个文件
+        self.dirname_changes = self.dirname_output.joinpath('%s_changes' %
+                                                            self.name)
+        if not self.dirname_changes.exists():
+            self.dirname_changes.mkdir()
+        self.spec_ids = None
+
+        # 每个url的请求次数
+        self.request_counts = Counter()
+        # 同时进行的请求数, 在async_get_df_configuration_by_model_ids中创建
+        self.request_semaphore = None
 
         msgs = [
-            'self.result_pkl is %s' % self.result_pkl.as_posix(),
+            'self.store is %s' % self.store.dirname.as_posix(),
             'you can use self.session or self.driver',
             'init_preparetion done',
             '-' * 20,
@@ -59,15 +116,41 @@ class Autohome_Configuration(Async_Spider):
         for msg in msgs:
             print(msg)
 
-    def read_exist_data(self, clipboard=True):
-        if self.result_pkl.exists():
-            df_exist = pd.read_pickle(self.result_pkl)
-        else:
-            df_exist = pd.DataFrame()
+    @property
+    def df_models(self):
+        return get_context(self.dirname_output).df_models
+
+    def migrate_result_pkl(self):
+        # 旧版result_pkl拆分为model_id分区, 只在store为空时运行
+        if not self.result_pkl.exists():
+            return
+        with self.store.lock():
+            if len(self.store) == 0:
+                print('migrate %s to %s' % (self.result_pkl.as_posix(),
+                                            self.store.dirname.as_posix()))
+                self.store.migrate(pd.read_pickle(self.result_pkl),
+                                   ('model_id', '', '', ''))
+
+    def read_exist_data(self, clipboard=True, model_ids=None):
+        # model_ids为None时读取全部分区
+        self.migrate_result_pkl()
+        if model_ids is not None:
+            model_ids = [str(model_id) for model_id in model_ids]
+        df_exist = self.store.read(model_ids)
         if clipboard:
             self.df_to_clipboard(df_exist)
         return df_exist
 
+    def read_exist_data_encoded(self, model_ids=None):
+        # return (df_encoded, encodings), decode_frame(df_encoded, encodings) 还原
+        # 分区逐批读取并编码, 不生成完整的object宽表
+        self.migrate_result_pkl()
+        if model_ids is None:
+            keys = self.store.keys()
+        else:
+            keys = [str(model_id) for model_id in model_ids]
+        return encode_partitions(self.store.read_partition, keys)
+
     def read_exist_keylink(self, clipboard=True):
         if self.result_keylink_pkl.exists():
             df_keylink = pd.read_pickle(self.result_keylink_pkl)
@@ -90,7 +173,8 @@ class Autohome_Configuration(Async_Spider):
 
         return wrapper
 
-    def js_generate_js(self, response):
+    def js_generate_js(self, response, js_lst=None):
+        # js_lst: fetch_page_vars返回的'js', 为None时从response查找
         try:
             js_result = (
                 "var rules = '';"
@@ -116,15 +200,35 @@ class Autohome_Configuration(Async_Spider):
                 "var window = {};"
                 "window.decodeURIComponent = decodeURIComponent;")
 
-            js_lst = re.findall(
-                '(\(function\([a-zA-Z]{2}.*?_\).*?\(document\);)',
-                response.text)
+            if js_lst is None:
+                js_lst = fetch_page_vars(response.text)['js']
             for js in js_lst:
                 js_result += js
             return js_result
         except Exception as e:
             return
 
+    @property
+    def js_pool(self):
+        # 没有node时为None
+        if self._js_pool is None and self.js_workers:
+            pool = Js_Runtime_Pool(size=self.js_workers)
+            if pool.is_available():
+                self._js_pool = pool
+        return self._js_pool
+
+    async def async_js_return_var(self, js, var):
+        # 在线程池中运行, 不阻塞事件循环
+        # 常驻node进程出错时使用js_return_var
+        loop = asyncio.get_running_loop()
+        if self.js_pool is not None:
+            try:
+                return await loop.run_in_executor(None, self.js_pool.eval_var,
+                                                  js, var)
+            except RuntimeError as e:
+                self.logger.warning(e)
+        return await loop.run_in_executor(None, self.js_return_var, js, var)
+
     def js_generate_css_dict(self, rules):
         rules = rules.split('#')
         regex_key = re.compile(r'\.(.*?)::')
@@ -136,17 +240,23 @@ class Autohome_Configuration(Async_Spider):
         }
         return css_dict
 
-    def js_fetch_var(self, response, var, css_dict={}):
+    def js_fetch_var(self, response, var, css_dict=None):
         # 查找css返回正常的值
-        css_dict.update({'&nbsp': ' '})
-        regex_var_pattern = '.*var {var} = (.*);'.format(var=var)
-        regex_replace = re.compile('|'.join(map(re.escape, css_dict)))
-        # 寻找var的定义
-        value = re.compile(regex_var_pattern.format(var=var)).search(
-            response.text).group(1)
+        return self.js_fetch_vars(response, css_dict, [var])[var]
+
+    def js_fetch_vars(self, response, css_dict=None, var_list=None, page=None):
+        # page: fetch_page_vars的结果, 为None时扫描response.text
         # 替换特殊字符和css混淆
-        value = regex_replace.sub(lambda m: css_dict[m.group(0)], value)
-        return value
+        if css_dict is None:
+            css_dict = {}
+        if var_list is None:
+            var_list = page_vars
+        if page is None:
+            page = fetch_page_vars(response.text)
+        return {
+            var: replace_placeholder(page[var], css_dict)
+            for var in var_list
+        }
 
     def find_year_id(self, response, return_type='bool'):
         # return_type: 'bool'
@@ -224,7 +334,7 @@ class Autohome_Configuration(Async_Spider):
         df_config = pd.DataFrame(datas, columns=columns_config)
         # 转置处理
         df_config = df_config.pivot(
-            'spec_id',
+            index='spec_id',
             columns=['cattype_1', 'cattype_2', 'cattype_3', 'cattype_4'],
             values='value').reset_index()
         return df_config
@@ -266,77 +376,214 @@ class Autohome_Configuration(Async_Spider):
         df_option = pd.DataFrame(datas, columns=columns_option)
         # 转置处理
         df_option = df_option.pivot(
-            'spec_id',
+            index='spec_id',
             columns=['cattype_1', 'cattype_2', 'cattype_3', 'cattype_4'],
             values='value').reset_index()
         return df_option
 
-    async def async_update_keylink(self, response, css_dict):
+    def build_df_configuration(self, json_config, json_option):
+        # config, option 直接生成宽表, 与process_config, process_option后merge结果相同
+        # 每列一个数组, 不生成长表, 不pivot, 不merge
+        configs = json.loads(json_config)
+        options = json.loads(json_option)
+        columns = []
+        column_idx = {}
+        cells = []  # [(列序号, spec_id, value)]
+        append = cells.append
+
+        def get_idx(column):
+            idx = column_idx.get(column)
+            if idx is None:
+                idx = column_idx[column] = len(columns)
+                columns.append(column)
+            return idx
+
+        spec_ids_config = set()
+        for paramtypeitem in configs['result']['paramtypeitems']:
+            for valueitem in paramtypeitem['paramitems']:
+                idx = get_idx(('config', paramtypeitem['name'],
+                               valueitem['name'], None))
+                for items in valueitem['valueitems']:
+                    append((idx, items['specid'], items['value']))
+                spec_ids_config.update(
+                    items['specid'] for items in valueitem['valueitems'])
+        spec_ids_option = set()
+        for configtypeitem in options['result']['configtypeitems']:
+            for valueitem in configtypeitem['configitems']:
+                column = ('option', configtypeitem['name'], valueitem['name'])
+                idx = None
+                for items in valueitem['valueitems']:
+                    spec_id = items['specid']
+                    spec_ids_option.add(spec_id)
+                    if len(items['sublist']):
+                        for sub in items['sublist']:
+                            append((get_idx(column + (sub['subname'], )),
+                                    spec_id, sub['subvalue']))
+                    else:
+                        if idx is None:
+                            idx = get_idx(column + (None, ))
+                        append((idx, spec_id, items['value']))
+
+        # 与merge(on='spec_id')相同: 两者都有的spec_id, 升序
+        spec_ids = sorted(spec_ids_config & spec_ids_option)
+        row_idx = {spec_id: i for i, spec_id in enumerate(spec_ids)}
+        cells = [(row_idx[spec_id], idx, v) for idx, spec_id, v in cells
+                 if spec_id in row_idx]
+        # 一个object二维数组, 一次赋值
+        values = np.full((len(spec_ids), len(columns)), np.nan, dtype=object)
+        if cells:
+            rows, idxs, vs = zip(*cells)
+            vs_array = np.empty(len(vs), dtype=object)
+            vs_array[:] = vs
+            values[list(rows), list(idxs)] = vs_array
+
+        # 列顺序与页面一致
+        df_configuration = pd.DataFrame(
+            values,
+            dtype=object,
+            columns=pd.MultiIndex.from_tuples(
+                columns,
+                names=['cattype_1', 'cattype_2', 'cattype_3', 'cattype_4']))
+        df_configuration.insert(0, ('spec_id', '', '', ''),
+                                np.array(spec_ids))
+        return df_configuration
+
+    async def async_update_keylink(self, json_keylink):
         # async 更新keylink
         if not self.result_keylink_pkl.exists():
-            json_keylink = self.js_fetch_var(response, 'keyLink', css_dict)
             self.df_keylink = self.process_keylink(json_keylink, opencsv=False)
 
+    async def async_get_response_with_retry(self,
+                                            url,
+                                            meta=None,
+                                            max_retry=None,
+                                            backoff=0.5,
+                                            max_backoff=30):
+        # 成功后立即返回, 最多请求max_retry+1次
+        # 只在请求失败或状态码在retry_status_codes中时重试
+        # 等待时间: 指数退避 + full jitter
+        if max_retry is None:
+            max_retry = self.max_retry
+        for attempt in range(max_retry + 1):
+            self.request_counts[url] += 1
+            if self.request_semaphore is None:
+                response = await self.async_get_response(url, meta=meta)
+            else:
+                async with self.request_semaphore:
+                    response = await self.async_get_response(url, meta=meta)
+            if response is not None and (response.status_code
+                                         not in self.retry_status_codes):
+                return response
+            if attempt < max_retry:
+                delay = min(max_backoff, backoff * 2**attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+        self.logger.warning('failed after %s requests: %s' %
+                            (max_retry + 1, url))
+
     async def async_get_df_configuration_by_model_id(self,
                                                      model_id,
                                                      update_keylink=False,
-                                                     opencsv=False):
+                                                     opencsv=False,
+                                                     recrawl=False,
+                                                     history=False):
+        # recrawl=True 已有的spec_id也重新解析, 用于检查参数变化
+        # history=True 停售车型抓取所有年款, 见async_get_df_configuration_history
         # async 更新gonfiguration
-        max_retry = self.max_retry
-        while True:
-            max_retry -= 1
-            response = await self.async_get_response(
-                self.url_configuration % model_id, meta={'model_id': model_id})
-            if response is not None and max_retry < 0:
-                break
-        # response = self.run_async_loop([
-        #     self.async_get_response(self.url_configuration % model_id,
-        #                             meta={'model_id': model_id})
-        # ])[0].result()
+        response = await self.async_get_response_with_retry(
+            self.url_configuration % model_id, meta={'model_id': model_id})
+        if response is None:
+            return
         # response = self.session.get(self.url_configuration % model_id)
         # print(self.url_configuration % model_id)
 
         # 判断是否是停售
         year_id = self.find_year_id(response)
         if year_id:  # 停售
+            if not history:
+                return
+            df_configuration = await self.async_get_df_configuration_history(
+                model_id, response, update_keylink, recrawl)
+        else:
+            df_configuration = await self.async_parse_configuration(
+                response, model_id, update_keylink, recrawl)
+        if opencsv and df_configuration is not None:
+            self.df_to_csv(df_configuration)
+        return df_configuration
+
+    async def async_get_df_configuration_history(self,
+                                                 model_id,
+                                                 response,
+                                                 update_keylink=False,
+                                                 recrawl=False):
+        # response: 停售车型的页面, 由其中的year_id并发抓取每个年款
+        # 添加year_id, year 两列
+        year_ids = self.find_year_id(response, 'dict')
+        if not isinstance(year_ids, dict) or len(year_ids) == 0:
             return
+        responses = await asyncio.gather(*[
+            self.async_get_response_with_retry(
+                self.url_configuration_for_stop.format(series_id=model_id,
+                                                       year_id=year_id),
+                meta={
+                    'model_id': model_id,
+                    'year_id': year_id
+                }) for year_id in year_ids
+        ])
+        dfs = []
+        for (year_id, year), response in zip(year_ids.items(), responses):
+            if response is None:
+                continue
+            df_year = await self.async_parse_configuration(
+                response, model_id, update_keylink, recrawl)
+            if df_year is not None:
+                df_year['year_id'] = year_id
+                df_year['year'] = year
+                dfs.append(df_year)
+        if dfs:
+            return pd.concat(dfs, ignore_index=True)
+
+    async def async_parse_configuration(self,
+                                        response,
+                                        model_id,
+                                        update_keylink=False,
+                                        recrawl=False):
+        # 解析配置页面, 在售和停售年款共用
         # 判断是否有spec_ids
         spec_ids = self.find_spec_id(response)
-        if spec_ids is None or self.check_spec_id(spec_ids,
-                                                  self.df_exist):  # 待售
+        if spec_ids is None:  # 待售
+            return
+        if not recrawl and self.check_spec_id(spec_ids, self.spec_ids):
             return
 
-        js = self.js_generate_js(response)
-        rules = self.js_return_var(js, 'rules')
+        # 页面只扫描一次
+        page = fetch_page_vars(response.text)
+        js = self.js_generate_js(response, page['js'])
+        rules = await self.async_js_return_var(js, 'rules')
         css_dict = self.js_generate_css_dict(rules)
 
+        var_list = ['config', 'option', 'keyLink'
+                    ] if update_keylink else ['config', 'option']
+        var_dict = self.js_fetch_vars(response, css_dict, var_list, page)
         if update_keylink:
-            await self.async_update_keylink(update_keylink, response, css_dict)
-        # if update_keylink or not self.result_keylink_pkl.exists():
-        #     json_keylink = self.js_fetch_var(response, 'keyLink', css_dict)
-        #     self.df_keylink = self.process_keylink(json_keylink, opencsv=False)
-
-        var_dict = {
-            var: self.js_fetch_var(response, var, css_dict)
-            for var in ['config', 'option']
-        }
+            await self.async_update_keylink(var_dict['keyLink'])
 
-        df_config = self.process_config(var_dict['config'])
-        df_option = self.process_option(var_dict['option'])
-        # 合并
-        df_configuration = df_config.merge(df_option, on='spec_id')
+        df_configuration = self.build_df_configuration(
+            var_dict['config'], var_dict['option'])
         # 添加model_id
         df_configuration['model_id'] = model_id
-        if opencsv:
-            self.df_to_csv(df_configuration)
         return df_configuration
 
     async def async_get_df_configuration_by_model_ids(self,
                                                       model_ids,
-                                                      update_keylink=False):
+                                                      update_keylink=False,
+                                                      recrawl=False,
+                                                      history=False):
+        # 所有车型和年款页面共用concurrency个请求
+        self.request_semaphore = asyncio.Semaphore(self.concurrency)
         tasks = [
             self.async_get_df_configuration_by_model_id(
-                model_id, update_keylink) for model_id in model_ids
+                model_id, update_keylink, recrawl=recrawl, history=history)
+            for model_id in model_ids
         ]
         results = await asyncio.gather(*tasks)
         return results
@@ -356,61 +603,139 @@ class Autohome_Configuration(Async_Spider):
             index=True)
         return df_configuration
 
-    def check_spec_id(self, spec_ids, df_exist):
-        # series = df_exist['spec_id']
-        # 当spec_id中有任何一个不在series中, 返回False
-
-        if df_exist is None:
+    def check_spec_id(self, spec_ids, exist_spec_ids):
+        # exist_spec_ids: 已有spec_id的set, 见load_spec_ids
+        # 当spec_id中有任何一个不在exist_spec_ids中, 返回False
+        if exist_spec_ids is None:
             return False  # 当series不存在, 直接返回False
-
-        s = pd.Series(spec_ids, dtype=str)
-        series = df_exist['spec_id']
-        series = series.astype(str)
-        check = s.map(lambda x: x in series.to_list())
-        return check.all()
+        return {str(spec_id) for spec_id in spec_ids} <= exist_spec_ids
+
+    def get_changed_rows(self, df_result, fingerprints):
+        # 只保留新增或fingerprint变化的spec
+        fingerprints_new = fingerprint_rows(df_result,
+                                            ('spec_id', '', '', ''))
+        changed = [
+            fingerprints.get(spec_id) != fingerprint
+            for spec_id, fingerprint in fingerprints_new.items()
+        ]
+        return df_result[changed]
+
+    def get_changes(self, df_partition, df_changed):
+        # return [(model_id, spec_id, column, old, new)], 只包含已有spec的变化
+        if df_partition is None or len(df_changed) == 0:
+            return []
+        id_column = ('spec_id', '', '', '')
+        df_old = df_partition.set_index(
+            df_partition[id_column].astype(str)).drop(columns=[id_column])
+        df_new = df_changed.set_index(
+            df_changed[id_column].astype(str)).drop(columns=[id_column])
+        spec_ids = df_new.index.intersection(df_old.index)
+        columns = df_old.columns.union(df_new.columns, sort=False)
+        df_old = df_old.reindex(index=spec_ids, columns=columns)
+        df_new = df_new.reindex(index=spec_ids, columns=columns)
+        changes = []
+        for spec_id, olds, news, model_id in zip(
+                spec_ids, df_old.to_numpy(dtype=object),
+                df_new.to_numpy(dtype=object),
+                df_new[('model_id', '', '', '')]):
+            for column, old, new in zip(columns, olds, news):
+                if pd.isna(old) and pd.isna(new):
+                    continue
+                if pd.isna(old) or pd.isna(new) or str(old) != str(new):
+                    changes.append((model_id, spec_id, column, old, new))
+        return changes
+
+    def save_changes(self, changes):
+        # 每次运行保存为一个文件, 不修改已有记录
+        df_changes = pd.DataFrame(
+            changes, columns=['model_id', 'spec_id', 'column', 'old', 'new'])
+        df_changes['time'] = pd.Timestamp.now()
+        filename = self.dirname_changes.joinpath(
+            'changes_%s.pkl' % time.strftime('%Y%m%d%H%M%S'))
+        atomic_write(filename, df_changes.to_pickle)
+        return df_changes
+
+    def read_changes(self, since=None):
+        # since: pd.Timestamp 或 str, 只读取之后的变化
+        dfs = [
+            pd.read_pickle(filename)
+            for filename in sorted(self.dirname_changes.glob('changes_*.pkl'))
+        ]
+        if not dfs:
+            return pd.DataFrame(
+                columns=['model_id', 'spec_id', 'column', 'old', 'new', 'time'])
+        df_changes = pd.concat(dfs, ignore_index=True)
+        if since is not None:
+            df_changes = df_changes[df_changes['time'] >= pd.Timestamp(since)]
+        return df_changes
+
+    def get_new_spec_ids(self, spec_ids):
+        # 返回不在已有数据中的spec_id
+        if self.spec_ids is None:
+            self.spec_ids = self.load_spec_ids()
+        return {str(spec_id) for spec_id in spec_ids} - self.spec_ids
+
+    def load_spec_ids(self):
+        # 由manifest读取, 不读取分区
+        self.migrate_result_pkl()
+        return self.store.get_ids()
 
     @decorator_add_info_df_result
     def get_df_configuration_by_model_ids_main(self,
                                                model_ids,
                                                update_keylink=False,
-                                               opencsv=False):
-        filename = self.result_pkl
-        if not filename.exists():
-            self.df_exist = None
-            lenth = 0
-        else:
-            self.df_exist = self.read_exist_data(clipboard=False)
-            lenth = len(self.df_exist)
+                                               opencsv=False,
+                                               recrawl=False,
+                                               history=False):
+        # recrawl=True 重新解析所有车型, 只写入变化的spec, 变化记录见read_changes
+        # history=True 停售车型抓取所有年款, 结果含year_id, year
+        self.spec_ids = self.load_spec_ids()
 
         df_results = asyncio.run(
             self.async_get_df_configuration_by_model_ids(
-                model_ids, update_keylink))
-
-        df_results = [self.df_exist] + df_results
-        df_results = [d for d in df_results if d is not None]
-        # 合并
-        df_configuration = self.dfs_append(df_results)
-        # return df_configuration
-        if len(df_configuration) > lenth:
-            # 删除重复
-            df_configuration = df_configuration.drop_duplicates(subset=[
-                ('spec_id', '', '', '')
-            ],
-                                                                keep='last')
-            # 排序
-            df_configuration = df_configuration.sort_values(
-                ['model_id', 'spec_id'])
-            df_configuration = df_configuration.reset_index(drop=True)
-            # 调整columns顺序
-            df_configuration = self.df_configuration_columns_sort(
-                df_configuration)
-            # 保存
-            df_configuration.to_pickle(filename)
+                model_ids, update_keylink, recrawl=recrawl, history=history))
+
+        # 只写入有新增或变化的spec的model_id分区
+        # 读取分区 -> 合并 -> 写入 在锁内, 同时运行时不会丢失对方的行
+        dfs = {}
+        changes = []
+        with self.store.lock():
+            # manifest只读取一次
+            manifest = self.store.load_manifest()
+            for df_result in df_results:
+                if df_result is None:
+                    continue
+                model_id = str(df_result[('model_id', '', '', '')].iloc[0])
+                fingerprints = self.store.get_fingerprints(model_id, manifest)
+                df_result = self.get_changed_rows(df_result, fingerprints)
+                if len(df_result) == 0:
+                    continue
+                df_partition = self.store.read_partition(model_id)
+                changes += self.get_changes(df_partition, df_result)
+                if df_partition is not None:
+                    df_result = self.dfs_append([df_partition, df_result])
+                # 删除重复
+                df_result = df_result.drop_duplicates(
+                    subset=[('spec_id', '', '', '')], keep='last')
+                # 排序
+                df_result = df_result.sort_values([('spec_id', '', '', '')])
+                df_result = df_result.reset_index(drop=True)
+                # 调整columns顺序
+                dfs[model_id] = self.df_configuration_columns_sort(df_result)
+            self.store.write(dfs)
+
+        if dfs:
+            self.spec_ids = self.load_spec_ids()
         else:
             print(
                 'These is no new configuration data currently of model_ids %s'
                 % model_ids)
-            df_configuration = self.df_exist
+        if changes:
+            df_changes = self.save_changes(changes)
+            print('%s changes of %s specs' %
+                  (len(df_changes), df_changes['spec_id'].nunique()))
+        df_configuration = self.read_exist_data(clipboard=False,
+                                                model_ids=model_ids)
         return df_configuration
 
     def get_df_configuration_by_df_models(self, df_models):
@@ -429,6 +754,116 @@ if __name__ == '__main__':
     df_configuration = self.get_df_configuration_by_model_ids_main(
         model_ids, opencsv=False)
 
+# %%
+# 正常情况下每个车型只请求一次
+if __name__ == '__main__':
+    self = Autohome_Configuration()
+    model_ids = ['2896', '5200']
+    self.request_counts.clear()
+    df_configuration = self.get_df_configuration_by_model_ids_main(
+        model_ids, opencsv=False)
+    for model_id in model_ids:
+        url = self.url_configuration % model_id
+        assert self.request_counts[url] == 1, (url, self.request_counts[url])
+
+# %%
+# 单次扫描 vs 逐个var查找, 页面保存在output/pages
+if __name__ == '__main__':
+    import time
+    self = Autohome_Configuration()
+    dirname_pages = self.dirname_output.joinpath('pages')
+    if not dirname_pages.exists():
+        dirname_pages.mkdir()
+    texts = []
+    for model_id in ['2896', '5200', '3554', '692']:
+        filename = dirname_pages.joinpath('configuration_%s.html' % model_id)
+        if not filename.exists():
+            filename.write_bytes(
+                self.session.get(self.url_configuration % model_id).content)
+        texts.append(filename.read_bytes().decode('utf-8'))
+
+    def fetch_page_vars_by_var(text):
+        result = {
+            var: re.compile('.*var {var} = (.*);'.format(var=var)).search(
+                text).group(1)
+            for var in page_vars
+        }
+        result['js'] = re.findall(
+            '(\(function\([a-zA-Z]{2}.*?_\).*?\(document\);)', text)
+        return result
+
+    for func in [fetch_page_vars_by_var, fetch_page_vars]:
+        t0 = time.perf_counter()
+        for _ in range(10):
+            results = [func(text) for text in texts]
+        print('%s: %.4fs per page' % (func.__name__,
+                                      (time.perf_counter() - t0) /
+                                      (10 * len(texts))))
+    assert results == [fetch_page_vars_by_var(text) for text in texts]
+
+# %%
+# 常驻node进程与js_return_var结果一致, 页面来自上一个cell
+if __name__ == '__main__':
+    import time
+    jss = [self.js_generate_js(None, fetch_page_vars(text)['js'])
+           for text in texts]
+    t0 = time.perf_counter()
+    rules_pool = [self.js_pool.eval_var(js, 'rules') for js in jss]
+    t1 = time.perf_counter()
+    rules_execjs = [self.js_return_var(js, 'rules') for js in jss]
+    t2 = time.perf_counter()
+    assert rules_pool == rules_execjs
+    assert [self.js_generate_css_dict(rules) for rules in rules_pool]
+    print('pool %.4fs, js_return_var %.4fs' % (t1 - t0, t2 - t1))
+
+# %%
+# 宽表: build_df_configuration vs process_config + process_option + merge
+# 页面来自上面的cell
+if __name__ == '__main__':
+    import timeit
+    for text in texts:
+        page = fetch_page_vars(text)
+        func_old = lambda: self.process_config(page['config']).merge(
+            self.process_option(page['option']), on='spec_id')
+        func_new = lambda: self.build_df_configuration(page['config'],
+                                                       page['option'])
+        pd.testing.assert_frame_equal(func_new(),
+                                      func_old(),
+                                      check_dtype=False,
+                                      check_like=True)
+        seconds_old = min(timeit.repeat(func_old, number=5, repeat=3)) / 5
+        seconds_new = min(timeit.repeat(func_new, number=5, repeat=3)) / 5
+        print('%s cells: pivot+merge %.4fs, build %.4fs' %
+              (func_new().size, seconds_old, seconds_new))
+
+# %%
+# 新增spec_id检查
+if __name__ == '__main__':
+    self = Autohome_Configuration()
+    df_exist = self.read_exist_data(clipboard=False)
+    spec_ids = df_exist[('spec_id', '', '', '')].to_list()
+    assert self.get_new_spec_ids(spec_ids) == set()
+    assert self.check_spec_id(spec_ids, self.spec_ids)
+
+# %%
+# 重新抓取, 检查已有spec的参数变化
+if __name__ == '__main__':
+    self = Autohome_Configuration()
+    t0 = pd.Timestamp.now()
+    df_configuration = self.get_df_configuration_by_model_ids_main(
+        self.store.keys(), opencsv=False, recrawl=True)
+    df_changes = self.read_changes(since=t0)
+
+# %%
+# 停售车型的所有年款, 在售车型不变
+if __name__ == '__main__':
+    self = Autohome_Configuration()
+    model_ids = ['874']
+    df_configuration = self.get_df_configuration_by_model_ids_main(
+        model_ids, opencsv=False, history=True)
+    print(df_configuration[[('year_id', '', '', ''),
+                            ('year', '', '', '')]].value_counts())
+
 # %%
 # 按照df_models更新df_configuration
 if __name__ == '__main__':
@@ -441,6 +876,27 @@ if __name__ == '__main__':
     self = Autohome_Configuration()
     df_configuration = self.read_exist_data()
 # %%
+# 压缩编码: 内存对比及还原检查
+# 峰值内存: read_exist_data后编码 vs 分区逐批编码
+if __name__ == '__main__':
+    import tracemalloc
+    self = Autohome_Configuration()
+    tracemalloc.start()
+    df_configuration = self.read_exist_data(clipboard=False)
+    peak_read = tracemalloc.get_traced_memory()[1] / 2**20
+    del df_configuration
+    tracemalloc.reset_peak()
+    df_encoded, encodings = self.read_exist_data_encoded()
+    peak_encoded = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    print('peak: read_exist_data %.1fMB, read_exist_data_encoded %.1fMB' %
+          (peak_read, peak_encoded))
+    df_configuration = self.read_exist_data(clipboard=False)
+    report = memory_report(df_configuration, df_encoded)
+    pd.testing.assert_frame_equal(decode_frame(df_encoded, encodings),
+                                  df_configuration)
+
+# %%
 # 读取keyling
 if __name__ == '__main__':
     self = Autohome_Configuration()
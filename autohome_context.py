@@ -0,0 +1,99 @@
+# %%[markdown]
+# 进程内共享数据
+# - df_models, df_province_city, df_check_brand_ids 在第一次访问时读取
+# - 各个spider共用, 构造spider时不再读取pickle或访问网络
+# - spider保存新数据后通过update更新
+
+# %%
+import pathlib
+
+import pandas as pd
+
+
+# %%
+class Autohome_Context:
+    def __init__(self, dirname_output='output'):
+        self.dirname_output = pathlib.Path(dirname_output)
+        self.model_pkl = self.dirname_output.joinpath(
+            'autohome_model_result.pkl')
+        self.province_city_pkl = self.dirname_output.joinpath(
+            'dealer', 'autohome_dealer_result_province_city.pkl')
+        self.check_brand_ids_pkl = self.dirname_output.joinpath(
+            'dealer', 'autohome_dealer_result_check_brand_ids.pkl')
+        self.data = {}
+
+    def get(self, key, loader):
+        if key not in self.data:
+            self.data[key] = loader()
+        return self.data[key]
+
+    def update(self, **kwargs):
+        # spider保存新数据后调用, 例如update(df_models=df_result)
+        self.data.update(kwargs)
+        if 'df_province_city' in kwargs:
+            self.data.pop('province_dict', None)
+
+    def clear(self):
+        self.data = {}
+
+    @property
+    def df_models(self):
+        return self.get('df_models', self.load_df_models)
+
+    @property
+    def df_province_city(self):
+        return self.get('df_province_city', self.load_df_province_city)
+
+    @property
+    def df_check_brand_ids(self):
+        return self.get('df_check_brand_ids', self.load_df_check_brand_ids)
+
+    @property
+    def province_dict(self):
+        return self.get(
+            'province_dict', lambda: {
+                k: v
+                for k, v in self.df_province_city[
+                    ['id_province', 'name_province']].drop_duplicates().values
+            })
+
+    def load_df_models(self):
+        if self.model_pkl.exists():
+            return pd.read_pickle(self.model_pkl)
+        from autohome_model import Autohome_Model
+        return Autohome_Model(verbose=False).get_df_models(force=False,
+                                                           clipboard=False,
+                                                           opencsv=False)
+
+    def load_df_province_city(self):
+        if self.province_city_pkl.exists():
+            return pd.read_pickle(self.province_city_pkl)
+        from autohome_dealer import Autohome_Dealer
+        return Autohome_Dealer(verbose=False).get_df_province_city(
+            force=False, opencsv=False)
+
+    def load_df_check_brand_ids(self):
+        if self.check_brand_ids_pkl.exists():
+            return pd.read_pickle(self.check_brand_ids_pkl)
+        from autohome_dealer import Autohome_Dealer
+        return Autohome_Dealer(verbose=False).get_df_check_brand_ids(
+            force=False)
+
+
+_contexts = {}
+
+
+def get_context(dirname_output='output'):
+    key = pathlib.Path(dirname_output).resolve()
+    context = _contexts.get(key)
+    if context is None:
+        context = Autohome_Context(dirname_output)
+        _contexts[key] = context
+    return context
+
+
+# %%
+if __name__ == '__main__':
+    self = get_context()
+    print(len(self.df_models), len(self.df_province_city))
+# %%
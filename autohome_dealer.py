@@ -3,18 +3,30 @@ import re
 import time
 import pandas as pd
 import bs4
-from tqdm.auto import tqdm
-
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 
 from async_spider import Async_Spider
-from autohome_model import Autohome_Model
+from autohome_spider import Autohome_Spider_Mixin
+from autohome_catalog import get_catalog
+from autohome_context import get_context
+
+
+# %%
+# 模块级解析函数, 可在ProcessPoolExecutor中运行
+def fetch_brand_dealer_ids_from_content(content):
+    try:
+        bsobj = bs4.BeautifulSoup(content, features='lxml')
+        div = bsobj.find('div', {'class': 'dealer-list-wrap'})
+        ul = div.find('ul', {'class': 'list-box'})
+        lis = ul.findAll('li', {'class': 'list-item'})
+        if len(lis):
+            lis_id = [li.attrs['id'] for li in lis]
+            return lis_id
+    except Exception as e:
+        pass
 
 
 # %%
-class Autohome_Dealer(Async_Spider):
+class Autohome_Dealer(Autohome_Spider_Mixin, Async_Spider):
     '''
     0. need 'AutohomeManuUrls.xlsx'
 
@@ -26,17 +38,25 @@ class Autohome_Dealer(Async_Spider):
     '''
 
     name = 'autohome_dealer'
+    # 城市经销商分布页面缓存7天
+    cache_ttls = {
+        r'https://dealer\.autohome\.com\.cn/[a-z]+/?$': 7 * 86400,
+    }
 
     def __init__(self,
                  max_retry=3,
                  concurrency=100,
-                 threading_init_driver=False):
+                 threading_init_driver=False,
+                 verbose=True,
+                 parse_workers=None):
         super().__init__(max_retry=max_retry,
                          concurrency=concurrency,
                          threading_init_driver=threading_init_driver)
-        self.init_preparetion()
+        # parse_workers: 解析进程数, None 在事件循环中解析
+        self.parse_workers = parse_workers
+        self.init_preparetion(verbose=verbose)
 
-    def init_preparetion(self):
+    def init_preparetion(self, verbose=True):
 
         self.url_province_city = 'https://dealer.autohome.com.cn/DealerList/GetAreasAjax?provinceId=0&cityId=0&brandid=0&manufactoryid=0&seriesid=0&isSales=0'
         self.url_city_distritution = 'https://dealer.autohome.com.cn/%s'
@@ -75,26 +95,37 @@ class Autohome_Dealer(Async_Spider):
             'dealer_tel', 'dealer_address'
         ]]
 
-        self.get_df_province_city(force=False, opencsv=False)
-        self.df_models = Autohome_Model(verbose=False).get_df_models(
-            force=False, clipboard=False, opencsv=False)
-        self.df_brand_manu = self.df_models[[
-            'brand_id', 'brand_name', 'manu_id', 'manu_name'
-        ]].drop_duplicates()
-        self.df_check_brand_ids = self.get_df_check_brand_ids(force=False)
-
+        # df_models, df_province_city, df_check_brand_ids 第一次访问时读取
         # 注册特殊方法
         self.ohterway_dict = {
             '133': self.otherway_get_df_dealer_tesla,  # 特斯拉
         }
 
-        msgs = [
-            'you can use self.session or self.driver',
-            'init_preparetion done',
-            '-' * 20,
-        ]
-        for msg in msgs:
-            print(msg)
+        if verbose:
+            msgs = [
+                'you can use self.session or self.driver',
+                'init_preparetion done',
+                '-' * 20,
+            ]
+            for msg in msgs:
+                print(msg)
+
+    @property
+    def df_models(self):
+        return get_context(self.dirname_output).df_models
+
+    @property
+    def df_brand_manu(self):
+        return self.df_models[['brand_id', 'brand_name', 'manu_id',
+                               'manu_name']].drop_duplicates()
+
+    @property
+    def df_province_ciy(self):
+        return get_context(self.dirname_output).df_province_city
+
+    @property
+    def df_check_brand_ids(self):
+        return get_context(self.dirname_output).df_check_brand_ids
 
     def read_exist_pickle(self, filename):
         if filename.exists():
@@ -112,14 +143,13 @@ class Autohome_Dealer(Async_Spider):
             df_province_city = self.fetch_province_city_data_from_response(
                 task.result())
             df_province_city.to_pickle(filename)
+            get_context(self.dirname_output).update(
+                df_province_city=df_province_city)
         else:
-            df_province_city = self.read_exist_pickle(filename)
-            if df_province_city is None:
-                df_province_city = self.get_df_province_city(True)
+            df_province_city = get_context(
+                self.dirname_output).df_province_city
         if opencsv:
             self.df_to_csv(df_province_city)
-
-        self.df_province_ciy = df_province_city
         return df_province_city
 
     def fetch_province_city_data_from_response(self, response):
@@ -159,17 +189,15 @@ class Autohome_Dealer(Async_Spider):
                                         pinyin_city) for pinyin_city in
                 df_province_city['pinyin_city'].drop_duplicates()
             ]
-            tasks = self.run_async_loop(coroutines)
+            results = self.run_async_pipeline(
+                coroutines,
+                self.fetch_city_distribution_data_from_response,
+                tqdm_desc='fetch_city_distribution')
 
             datas = []
-            with tqdm(desc='fetch_city_distribution',
-                      total=len(tasks)) as pbar:
-                for task in tasks:
-                    pbar.update(1)
-                    data = self.fetch_city_distribution_data_from_response(
-                        task.result())
-                    if data:
-                        datas += data
+            for data in results:
+                if data:
+                    datas += data
 
             df_city_distribution = pd.DataFrame(
                 datas, columns=self.columns_city_distribution)
@@ -221,9 +249,8 @@ class Autohome_Dealer(Async_Spider):
         # brand_dealer主程序
 
         # 数据准备
-        df_brand_manu_select = self.df_brand_manu[
-            self.df_brand_manu['brand_id'] == brand_id]
-        brand_name = df_brand_manu_select['brand_name'].values[0]
+        catalog = get_catalog(self.dirname_output)
+        brand_name = catalog.get_name('brand', brand_id)
         filename = self.dirname_output_dealer_brand.joinpath('%s.pkl' %
                                                              brand_name)
 
@@ -241,14 +268,12 @@ class Autohome_Dealer(Async_Spider):
             df_brand_dealer = pd.DataFrame()  # 预留空结果
             manu_dealer_ids = {
                 k: []
-                for k in df_brand_manu_select['manu_id'].to_list()
+                for k in catalog.get_manu_ids_by_brand_id(brand_id)
             }
 
             # 获取manu_dealer_ids
             for manu_id in manu_dealer_ids:
-                manu_name = df_brand_manu_select[
-                    df_brand_manu_select['manu_id'] ==
-                    manu_id]['manu_name'].values[0]
+                manu_name = catalog.get_name('manu', manu_id)
                 df_count = self.count_brand_manu_dealer(brand_id, manu_id)
                 if df_count is None or len(df_count) == 0:
                     continue
@@ -266,9 +291,7 @@ class Autohome_Dealer(Async_Spider):
             if len(manu_dealer_ids):
                 # 处理manu_ids
                 for manu_id, dealer_ids in manu_dealer_ids.items():
-                    manu_name = df_brand_manu_select[
-                        df_brand_manu_select['manu_id'] ==
-                        manu_id]['manu_name'].values[0]
+                    manu_name = catalog.get_name('manu', manu_id)
                     if len(dealer_ids) == 0:
                         continue
                     df_dealer_info = self.get_df_dealer_info(dealer_ids)
@@ -349,32 +372,43 @@ class Autohome_Dealer(Async_Spider):
                                         'page_idx': page_idx,
                                     }) for pinyin_city in pinyin_cities
         ]
-        tasks = self.run_async_loop(coroutines)
+        results = self.run_async_pipeline(
+            coroutines,
+            self.fetch_meta_dealer_ids_from_response,
+            content_func=fetch_brand_dealer_ids_from_content)
         # 初始化完毕, 进入循环
         while True:
-            _dealer_ids, _coroutines = self.loop_run_dealer_manu_by_city(tasks)
+            _dealer_ids, _coroutines = self.loop_run_dealer_manu_by_city(
+                results)
             if len(_dealer_ids):
                 manu_dealer_ids += _dealer_ids
             if len(_coroutines) == 0:
                 break
             else:
-                tasks = self.run_async_loop(_coroutines)
+                results = self.run_async_pipeline(
+                    _coroutines,
+                    self.fetch_meta_dealer_ids_from_response,
+                    content_func=fetch_brand_dealer_ids_from_content)
 
         return manu_dealer_ids
 
-    def loop_run_dealer_manu_by_city(self, tasks):
+    def fetch_meta_dealer_ids_from_response(self, response, dealer_ids):
+        # 只保留meta和dealer_ids, 释放response
+        return response.meta, dealer_ids
+
+    def loop_run_dealer_manu_by_city(self, results):
+        # results: [(meta, dealer_ids)]
         _dealer_ids = []
         _coroutines = []
-        for task in tasks:
-            response = task.result()
-            # dealer_ids = self.fetch_brand_dealer_ids_from_response(response)
-            dealer_ids = self.fetch_brand_dealer_ids_from_response(response)
+        for result in results:
+            if result is None:
+                continue
+            meta, dealer_ids = result
             if dealer_ids:
                 # 保存结果
                 _dealer_ids += dealer_ids
                 if len(dealer_ids) == 15:
                     # 更新page_idx
-                    meta = response.meta
                     page_idx = meta['page_idx'] + 1
                     meta['page_idx'] = page_idx
                     _coroutines.append(
@@ -384,36 +418,29 @@ class Autohome_Dealer(Async_Spider):
         return _dealer_ids, _coroutines
 
     def fetch_brand_dealer_ids_from_response(self, response):
-        try:
-            bsobj = bs4.BeautifulSoup(response.content, features='lxml')
-            div = bsobj.find('div', {'class': 'dealer-list-wrap'})
-            ul = div.find('ul', {'class': 'list-box'})
-            lis = ul.findAll('li', {'class': 'list-item'})
-            if len(lis):
-                lis_id = [li.attrs['id'] for li in lis]
-                return lis_id
-        except Exception as e:
-            pass
+        return fetch_brand_dealer_ids_from_content(response.content)
 
     def get_df_dealer_info(self, dealer_ids):
         coroutines = [
             self.async_get_response(url=self.url_dealer_info % dealer_id)
             for dealer_id in dealer_ids
         ]
-        tasks = self.run_async_loop(coroutines)
-
-        dfs = []
-        for task in tasks:
-            try:
-                j = task.result().json()
-                df = pd.DataFrame([j.values()], columns=j.keys())
-                if len(df):
-                    dfs.append(df)
-            except Exception as e:
-                pass
+        results = self.run_async_pipeline(
+            coroutines,
+            self.fetch_dealer_info_from_response,
+            tqdm_desc='async_get_dealer_info')
+        dfs = [df for df in results if df is not None and len(df)]
         df_dealer_info = pd.concat(dfs)
         return df_dealer_info
 
+    def fetch_dealer_info_from_response(self, response):
+        try:
+            j = response.json()
+            df = pd.DataFrame([j.values()], columns=j.keys())
+            return df
+        except Exception as e:
+            pass
+
     def concat_str_in_dataframe(self, *args):
         args = [str(arg) for arg in args if not pd.isna(arg)]
         res = ','.join(args)
@@ -438,8 +465,11 @@ class Autohome_Dealer(Async_Spider):
             ]
             df_check_brand_ids = pd.DataFrame(results, columns=['brand_id'])
             df_check_brand_ids.to_pickle(filename)
+            get_context(self.dirname_output).update(
+                df_check_brand_ids=df_check_brand_ids)
         else:
-            df_check_brand_ids = pd.read_pickle(filename)
+            df_check_brand_ids = get_context(
+                self.dirname_output).df_check_brand_ids
         return df_check_brand_ids
 
     def otherway_get_df_dealer_tesla(self, force=False, opencsv=False):
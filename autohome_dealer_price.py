@@ -9,13 +9,19 @@ import bs4
 from functools import reduce
 
 from async_spider import Async_Spider
-from autohome_model import Autohome_Model
+from autohome_spider import Autohome_Spider_Mixin
 from autohome_dealer import Autohome_Dealer
+from autohome_catalog import get_catalog
+from autohome_context import get_context
 
 
 # %%
-class Autohome_Dealer_Price(Async_Spider):
+class Autohome_Dealer_Price(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_dealer_price'
+    # 车型spec页面缓存30天
+    cache_ttls = {
+        r'https://www\.autohome\.com\.cn/spec/\d+/$': 30 * 86400,
+    }
 
     def __init__(
         self,
@@ -52,9 +58,18 @@ class Autohome_Dealer_Price(Async_Spider):
             'CityId': 'id_city'
         }
 
-        self.df_models = Autohome_Model(verbose=False).read_exist_data(
-            clipboard=False)
-        self.autohome_dealer = Autohome_Dealer()
+        # df_models, autohome_dealer 第一次访问时读取
+        self._autohome_dealer = None
+
+    @property
+    def df_models(self):
+        return get_context(self.dirname_output).df_models
+
+    @property
+    def autohome_dealer(self):
+        if self._autohome_dealer is None:
+            self._autohome_dealer = Autohome_Dealer(verbose=False)
+        return self._autohome_dealer
 
     def read_df_dealer_price_by_model_id(self, model_id, opencsv=True):
         filename = self.dirname_dp_output.joinpath('%s.pkl' % model_id)
@@ -71,11 +86,8 @@ class Autohome_Dealer_Price(Async_Spider):
 
         # 获取brand_id
         model_id = '3554'
-        brand_id = self.df_vlookup(self.df_models,
-                                   'model_id',
-                                   'brand_id',
-                                   str(model_id),
-                                   top=True)
+        brand_id = get_catalog(self.dirname_output).get_model_attr(
+            model_id, 'brand_id')
         # 获取市场清单
         df_brand_dealer = self.autohome_dealer.get_df_brand_dealer_by_id(
             brand_id=brand_id)
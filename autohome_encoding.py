@@ -0,0 +1,336 @@
+# %%[markdown]
+# 宽表压缩编码, 主要用于Autohome_Configuration的结果
+# - 数值列: 全部为整数字符串 -> Int64, 全部为相同小数位数的字符串 -> float64
+#   混有少量非数值('-', '选配'等)时, 非数值编码为小于所有数值的sentinel, 见get_numeric_encoding
+# - 低基数列: '●', '○', '-', '选配' 等 -> category
+# - 其他列不变
+# - encodings记录每列的编码方式, decode_frame还原为原始的值和dtype
+# - 只有还原后完全相同时才使用该编码
+# - encode_partitions: 分区逐批读取并编码, 峰值内存不含完整的原始宽表
+
+# %%
+import re
+import math
+
+import numpy as np
+import pandas as pd
+
+regex_int = re.compile(r'^-?(0|[1-9]\d*)$')
+regex_float = re.compile(r'^-?(0|[1-9]\d*)\.(\d+)$')
+int64_min, int64_max = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+
+
+def fits_int64(v):
+    # 18位以内一定在int64范围内
+    return len(v) <= 18 or int64_min <= int(v) <= int64_max
+
+
+# %%
+def get_column_stats(s, stats=None):
+    # 编码所需的统计, 多个分区时在stats上累计
+    # stats: {'dtypes', 'notna', 'na_kinds', 'uniques'}, uniques为None时不能编码
+    if stats is None:
+        stats = {'dtypes': set(), 'notna': 0, 'na_kinds': set(),
+                 'uniques': set()}
+    stats['dtypes'].add(s.dtype)
+    if stats['uniques'] is None:
+        return stats
+    if s.dtype != object and not pd.api.types.is_string_dtype(s.dtype):
+        stats['uniques'] = None
+        return stats
+    notna = s.notna()
+    stats['notna'] += int(notna.sum())
+    # None 或 nan
+    stats['na_kinds'] |= {v is None for v in s[~notna]}
+    uniques = s[notna].unique()
+    if not all(isinstance(v, str) for v in uniques):
+        stats['uniques'] = None
+        return stats
+    stats['uniques'].update(uniques)
+    return stats
+
+
+def get_encoding(stats, max_ratio=0.5, max_sentinels=16):
+    # encoding: (类型, 小数位数, 空值, table), 不能编码时返回None
+    # 数值列的table: {sentinel: 非数值或None}, category的table: categories
+    uniques = stats['uniques']
+    if not uniques or len(stats['dtypes']) != 1:
+        return
+    na_kinds = stats['na_kinds']
+    na = None if na_kinds == {True} else np.nan
+    numeric = get_numeric_encoding(uniques, True in na_kinds
+                                   and False in na_kinds, max_sentinels)
+    if numeric is not None:
+        kind, decimals, sentinels = numeric
+        return kind, decimals, na, sentinels
+    # category 无法区分None和nan
+    if len(na_kinds) > 1:
+        return
+    if len(uniques) <= max(1, stats['notna'] * max_ratio):
+        return 'category', None, na, sorted(uniques)
+
+
+def get_numeric_encoding(uniques, none_sentinel=False, max_sentinels=16):
+    # 数值与少量非数值混合, 如 '4871', '-', '选配'
+    # 非数值(及与nan共存的None)编码为小于所有数值的sentinel
+    # return (类型, 小数位数, sentinels) 或 None
+    ints = {v: int(v) for v in uniques if regex_int.match(v) and fits_int64(v)}
+    floats = {}
+    decimals = set()
+    for v in uniques:
+        m = regex_float.match(v)
+        if m:
+            floats[v] = float(v)
+            decimals.add(len(m.group(2)))
+    if ints and not floats:
+        kind, values, decimals = 'int', ints, None
+        # '-0' 等不能原样还原
+        if any(str(x) != v for v, x in values.items()):
+            return
+    elif floats and not ints and len(decimals) == 1:
+        kind, values, decimals = 'float', floats, decimals.pop()
+        fmt = '%%.%sf' % decimals
+        if any(fmt % x != v for v, x in values.items()):
+            return
+    else:
+        return
+    others = sorted(set(uniques) - set(values))
+    if none_sentinel:
+        others.append(None)
+    # 非数值为主的列用category
+    if len(others) > min(max_sentinels, len(values)):
+        return
+    start = math.floor(min(values.values())) - 1
+    end = start - len(others)
+    if kind == 'int' and end < int64_min:
+        return
+    if kind == 'float' and end < -2**53:
+        return
+    sentinels = {
+        (start - k if kind == 'int' else float(start - k)): v
+        for k, v in enumerate(others)
+    }
+    return kind, decimals, sentinels
+
+
+def encode_series(s, max_ratio=0.5, max_sentinels=16):
+    # return (编码后的series, encoding), encoding为None时不编码
+    encoding = get_encoding(get_column_stats(s),
+                            max_ratio=max_ratio,
+                            max_sentinels=max_sentinels)
+    if encoding is None:
+        return s, None
+    encoded = encode_values(s, encoding)
+    if is_identical(decode_series(encoded, encoding, s.dtype), s):
+        return encoded, encoding
+    return s, None
+
+
+def is_identical(a, b):
+    # equals不区分None和nan
+    return a.equals(b) and (a.map(lambda v: v is None).astype(bool)
+                            == b.map(lambda v: v is None).astype(bool)).all()
+
+
+def encode_values(s, encoding):
+    kind, decimals, na, table = encoding
+    if kind == 'category':
+        return pd.Series(pd.Categorical(s, categories=table), index=s.index)
+    codes = {v: k for k, v in table.items()}
+    if None in codes:
+        # None与nan共存时None为sentinel, nan为空值
+        mask = s.notna() | s.map(lambda v: v is None).astype(bool)
+    else:
+        mask = s.notna()
+    # 只对unique值转换
+    labels, uniques = pd.factorize(s[mask], use_na_sentinel=False)
+    to_number = int if kind == 'int' else float
+    lookup = [
+        codes[None] if pd.isna(v) else
+        codes[v] if v in codes else to_number(v) for v in uniques
+    ]
+    if kind == 'int':
+        encoded = pd.Series(pd.NA, index=s.index, dtype='Int64')
+        encoded[mask] = np.array(lookup, dtype='int64')[labels]
+    else:
+        encoded = pd.Series(np.nan, index=s.index, dtype='float64')
+        encoded[mask] = np.array(lookup, dtype='float64')[labels]
+    return encoded
+
+
+def decode_series(s, encoding, dtype=object):
+    # dtype: 原始dtype
+    kind, decimals, na, table = encoding
+    if kind == 'category':
+        decoded = s.astype(object)
+        if na is None:
+            decoded = decoded.where(s.notna(), None)
+        return decoded.astype(dtype)
+    notna = s.notna()
+    values = s[notna]
+    if kind == 'int':
+        strs = values.astype('int64').astype(str).astype(object)
+    else:
+        fmt = '%%.%sf' % decimals
+        strs = pd.Series([fmt % v for v in values],
+                         index=values.index,
+                         dtype=object)
+    if table:
+        is_sentinel = values.isin(list(table))
+        # map会把None变成nan
+        strs[is_sentinel] = [table[v] for v in values[is_sentinel]]
+    # 用numpy数组赋值, pandas会把None变成nan
+    decoded = np.full(len(s), na, dtype=object)
+    decoded[notna.to_numpy()] = strs.to_numpy()
+    return pd.Series(decoded, index=s.index, dtype=object).astype(dtype)
+
+
+def encode_frame(df, max_ratio=0.5, max_sentinels=16):
+    # return (df_encoded, encodings)
+    # encodings: {'encodings': {列序号: encoding}, 'dtypes': {列序号: 原始dtype}}
+    columns = {}
+    encodings = {}
+    dtypes = {}
+    for i in range(df.shape[1]):
+        s = df.iloc[:, i]
+        encoded, encoding = encode_series(s,
+                                          max_ratio=max_ratio,
+                                          max_sentinels=max_sentinels)
+        columns[i] = encoded
+        if encoding is not None:
+            encodings[i] = encoding
+            dtypes[i] = s.dtype
+    df_encoded = pd.DataFrame(columns, index=df.index)
+    df_encoded.columns = df.columns
+    return df_encoded, {'encodings': encodings, 'dtypes': dtypes}
+
+
+def iter_partition_chunks(read_partition, keys, chunksize=50):
+    # 每chunksize个分区合并为一个df, 减少逐列处理的次数
+    dfs = []
+    for key in keys:
+        df = read_partition(key)
+        if df is not None:
+            dfs.append(df)
+        if len(dfs) == chunksize:
+            yield pd.concat(dfs, ignore_index=True)
+            dfs = []
+    if dfs:
+        yield pd.concat(dfs, ignore_index=True)
+
+
+def encode_partitions(read_partition,
+                      keys,
+                      max_ratio=0.5,
+                      max_sentinels=16,
+                      chunksize=50):
+    # 分区逐批读取并编码, 不生成完整的原始宽表
+    # 第一遍累计每列的统计, 第二遍按统计得到的encoding编码后合并
+    # 结果与encode_frame(pd.concat(分区, ignore_index=True))相同
+    # read_partition(key) -> df 或 None
+    stats = {}
+    total = 0
+    for df in iter_partition_chunks(read_partition, keys, chunksize):
+        total += len(df)
+        for i, column in enumerate(df.columns):
+            column_stats = get_column_stats(df.iloc[:, i], stats.get(column))
+            column_stats['rows'] = column_stats.get('rows', 0) + len(df)
+            stats[column] = column_stats
+    column_encodings = {}
+    for column, column_stats in stats.items():
+        # 部分分区中没有的列, 合并后为nan
+        if column_stats['rows'] < total:
+            column_stats['na_kinds'].add(False)
+        encoding = get_encoding(column_stats,
+                                max_ratio=max_ratio,
+                                max_sentinels=max_sentinels)
+        if encoding is not None:
+            column_encodings[column] = encoding
+
+    dfs = []
+    for df in iter_partition_chunks(read_partition, keys, chunksize):
+        columns = {}
+        for i, column in enumerate(df.columns):
+            s = df.iloc[:, i]
+            if column in column_encodings:
+                s = encode_values(s, column_encodings[column])
+            columns[i] = s
+        df_encoded = pd.DataFrame(columns, index=df.index)
+        df_encoded.columns = df.columns
+        dfs.append(df_encoded)
+    if not dfs:
+        return pd.DataFrame(), {'encodings': {}, 'dtypes': {}}
+    df_encoded = pd.concat(dfs, ignore_index=True)
+    encodings = {}
+    dtypes = {}
+    for i, column in enumerate(df_encoded.columns):
+        if column in column_encodings:
+            encodings[i] = column_encodings[column]
+            dtypes[i] = next(iter(stats[column]['dtypes']))
+    return df_encoded, {'encodings': encodings, 'dtypes': dtypes}
+
+
+def decode_frame(df_encoded, encodings):
+    columns = {}
+    for i in range(df_encoded.shape[1]):
+        s = df_encoded.iloc[:, i]
+        if i in encodings['encodings']:
+            s = decode_series(s, encodings['encodings'][i],
+                              encodings['dtypes'][i])
+        columns[i] = s
+    df = pd.DataFrame(columns, index=df_encoded.index)
+    df.columns = df_encoded.columns
+    return df
+
+
+def memory_report(df, df_encoded=None, verbose=True):
+    # 编码前后的内存, 单位MB
+    if df_encoded is None:
+        df_encoded, _ = encode_frame(df)
+    before = df.memory_usage(deep=True).sum() / 2**20
+    after = df_encoded.memory_usage(deep=True).sum() / 2**20
+    kinds = pd.Series([
+        'category' if isinstance(dtype, pd.CategoricalDtype) else str(dtype)
+        for dtype in df_encoded.dtypes
+    ]).value_counts().to_dict()
+    report = {
+        'shape': df.shape,
+        'before_mb': before,
+        'after_mb': after,
+        'ratio': before / after if after else None,
+        'dtypes': kinds,
+    }
+    if verbose:
+        print('%s: %.1fMB -> %.1fMB (%.1fx), %s' %
+              (report['shape'], before, after, report['ratio'] or 0, kinds))
+    return report
+
+
+# %%
+if __name__ == '__main__':
+    df = pd.DataFrame({
+        'a': ['●', '○', '-', '●', None],
+        'b': ['4871', '4900', None, '4871', '5000'],
+        'c': ['1.50', '2.00', '1.80', None, '1.50'],
+        'd': ['x1', 'x2', 'x3', 'x4', 'x5'],
+    })
+    df_encoded, encodings = encode_frame(df)
+    pd.testing.assert_frame_equal(decode_frame(df_encoded, encodings), df)
+    memory_report(df, df_encoded)
+
+    # 超出int64的整数字符串不使用int编码
+    df = pd.DataFrame({'e': ['99999999999999999999', '1', '2', None]})
+    df_encoded, encodings = encode_frame(df)
+    pd.testing.assert_frame_equal(decode_frame(df_encoded, encodings), df)
+
+    # 数值与'-', '选配'混合; None与nan共存
+    df = pd.DataFrame({
+        'f': ['4871', '4900', '-', '4871', '选配', None],
+        'g': ['1.50', '-', '2.25', None, '选配', '1.50'],
+        'h': ['1', None, np.nan, '-', '2', '3'],
+    }, dtype=object)
+    df_encoded, encodings = encode_frame(df)
+    assert [str(dtype) for dtype in df_encoded.dtypes
+            ] == ['Int64', 'float64', 'Int64']
+    pd.testing.assert_frame_equal(decode_frame(df_encoded, encodings), df)
+# %%
@@ -5,40 +5,561 @@
 # 3. [百度字体编辑器](https://kekee000.github.io/fonteditor/index-en.html)
 # 4. [OpenCV Freetype](https://www.pythonheidong.com/blog/article/327766/a72be84affd143fcc7f1/)
 # 5. [Python/Matplotlib - 更改子图的相对大小](https://qa.1r1g.com/sf/ask/355863441/)
+# 6. matplotlib, fontTools, PIL, baidu_orc 在使用backend时才导入
+# 7. 每个页面的字体只是打乱了编码, 字形轮廓相同
+#    Glyph_Cache 保存 {轮廓fingerprint: 文字}, 只有没见过的字形才识别
+#    没见过的字形跨页面去重后拼成尽量少的图片, 并发请求百度, 不写临时文件
+#    识别的文字数与字形数不一致时, 图片分成两半重新识别, 只丢弃识别不了的字形
+#    Ttf_Cache 按ttf内容的sha1保存字体文件和识别结果, 相同的ttf不再下载和识别
+# 8. backend='template' 不需要网络: 字形栅格化为numpy bitmap, 与已识别字形的bitmap库比较
+#    bitmap库由其他backend的识别结果生成, 见Autohome_Font.update_template_library
 # %%
 import re
-import os
+import time
+import hashlib
 import pathlib
 import pickle
-import tempfile
 from io import BytesIO
-from functools import reduce
-from PIL import Image
+from functools import reduce, lru_cache, partial
+from collections import Counter
 import numpy as np
-from tqdm.auto import tqdm
 
-from fontTools.ttLib import TTFont
-from fontTools.pens.freetypePen import FreeTypePen
-from fontTools.misc.transform import Offset
+from autohome_store import atomic_write, file_lock
 
-from fontTools.pens.svgPathPen import SVGPathPen
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.path import Path
-import matplotlib.gridspec as gridspec
 
-from baidu_orc import Baidu_ORC
+# %%
+def gname_to_char(gname):
+    # 调整名称为之家文字中的格式, 示例 uniEDE4 -> \uede4
+    return chr(int(gname[3:], 16))
+
+
+def fingerprint_glyph(font, gname):
+    # 由glyf的坐标, 轮廓终点, on-curve标志计算, 坐标减去bbox左下角
+    glyf = font['glyf']
+    coords, end_pts, flags = glyf[gname].getCoordinates(glyf)
+    coords = np.array(list(coords), dtype=np.float64).reshape(-1, 2)
+    if len(coords):
+        coords = coords - coords.min(axis=0)
+    h = hashlib.sha1()
+    h.update(np.round(coords).astype(np.int32).tobytes())
+    h.update(np.array(end_pts, dtype=np.int32).tobytes())
+    h.update((np.array(flags, dtype=np.uint8) & 1).tobytes())
+    return h.hexdigest()
+
+
+def fingerprint_font(font):
+    # return {gname: fingerprint}, 按glyph order, 不含.notdef
+    return {
+        gname: fingerprint_glyph(font, gname)
+        for gname in font.getGlyphOrder()[1:]
+    }
+
+
+def match_baidu_result(gnames, baidu_result):
+    # return {gname: 文字}, 识别的文字数与gnames不一致时返回None
+    # gnames 也可以是 [(k, gname)]
+    if baidu_result is None or 'words_result' not in baidu_result:
+        return
+    words = ''.join([w['words'] for w in baidu_result['words_result']])
+    if len(words) == len(gnames):
+        return dict(zip(gnames, words))
+
+
+def recognize_images_by_baidu(baidu_orc, chunks, plot_chunk):
+    # chunks: 每张图片中的[(k, gname)], plot_chunk(chunk) -> png bytes, 并发请求
+    # 识别的文字数不一致时, 该图片分成两半重新识别, 一个字形的图片不再拆分
+    # return {(k, gname): 文字}, 未识别的字形不包含
+    recognized = {}
+    total = sum(len(chunk) for chunk in chunks)
+    retried = 0
+    while chunks:
+        images = [plot_chunk(chunk) for chunk in chunks]
+        results = baidu_orc.general_basic_batch(images)
+        retry_chunks = []
+        for chunk, result in zip(chunks, results):
+            matched = match_baidu_result(chunk, result)
+            if matched is not None:
+                recognized.update(matched)
+            elif result is not None and len(chunk) > 1:
+                half = len(chunk) // 2
+                retry_chunks += [chunk[:half], chunk[half:]]
+        retried += len(retry_chunks)
+        chunks = retry_chunks
+    dropped = total - len(recognized)
+    if retried or dropped:
+        print('baidu ocr: %s glyphs, %s split retries, %s glyphs dropped' %
+              (total, retried, dropped))
+    return recognized
+
+
+def split_recognized(recognized):
+    # {(k, gname): 文字} -> {k: {文字编码: 文字}}
+    fonts_dict = {}
+    for (k, gname), v in recognized.items():
+        fonts_dict.setdefault(k, {})[gname_to_char(gname)] = v
+    return fonts_dict
+
+
+def get_all_items(fonts):
+    # 所有字体的[(k, gname)], 不含.notdef
+    return [(k, gname) for k, font in fonts.items()
+            for gname in font.getGlyphOrder()[1:]]
+
+
+class Glyph_Cache:
+    # {fingerprint: 文字}, 保存在font/glyph_cache.pkl
+    # 多个进程共用, 保存时加锁重新读取, 只合并本次新识别的字形
+    def __init__(self, filename='font/glyph_cache.pkl'):
+        self.filename = pathlib.Path(filename)
+        self.lock_filename = self.filename.with_suffix('.lock')
+        self.chars = self.load()
+        # update后未保存的{fingerprint: 文字}
+        self.pending = {}
+        # hit, miss, stored
+        self.counts = Counter()
+
+    def load(self):
+        if self.filename.exists():
+            with open(self.filename, 'rb') as f:
+                return pickle.load(f)
+        return {}
+
+    def save(self):
+        if not self.filename.parent.exists():
+            self.filename.parent.mkdir(parents=True)
+        with file_lock(self.lock_filename):
+            chars = self.load()
+            chars.update(self.pending)
+
+            def dump(tmp):
+                with open(tmp, 'wb') as f:
+                    pickle.dump(chars, f)
+
+            atomic_write(self.filename, dump)
+        self.chars = chars
+        self.pending = {}
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.chars
+
+    def __len__(self):
+        return len(self.chars)
+
+    def get(self, fingerprint):
+        return self.chars.get(fingerprint)
+
+    def update(self, chars):
+        self.counts['stored'] += len(chars)
+        self.chars.update(chars)
+        self.pending.update(chars)
+
+    def get_unseen(self, fonts_fingerprints):
+        # return {k: [gname]}, 每个未见过的fingerprint只在第一个字体中识别
+        unseen = {}
+        scheduled = set()
+        for k, fingerprints in fonts_fingerprints.items():
+            gnames = []
+            for gname, fingerprint in fingerprints.items():
+                if fingerprint in self.chars:
+                    self.counts['hit'] += 1
+                elif fingerprint not in scheduled:
+                    self.counts['miss'] += 1
+                    scheduled.add(fingerprint)
+                    gnames.append(gname)
+            if gnames:
+                unseen[k] = gnames
+        return unseen
+
+    def get_font_dict(self, fingerprints):
+        # return {文字编码: 文字}, 只包含已识别的字形
+        return {
+            gname_to_char(gname): self.chars[fingerprint]
+            for gname, fingerprint in fingerprints.items()
+            if fingerprint in self.chars
+        }
+
+
+class Ttf_Cache:
+    # ttf文件: font/ttf/<sha1>.ttf
+    # index.pkl: {'urls': {url: sha1}, 'font_dicts': {sha1: {文字编码: 文字}}}
+    # 只保存识别了全部字形的font_dict
+    # 多个实例或进程共用index.pkl, 保存时加锁重新读取, 只合并本次修改的key
+    def __init__(self, dirname='font/ttf'):
+        self.dirname = pathlib.Path(dirname)
+        if not self.dirname.exists():
+            self.dirname.mkdir(parents=True)
+        self.index_pkl = self.dirname.joinpath('index.pkl')
+        self.lock_filename = self.dirname.joinpath('.lock')
+        self.index = self.load_index()
+        # url_hit, font_dict_hit, stored
+        self.counts = Counter()
+
+    def load_index(self):
+        if self.index_pkl.exists():
+            with open(self.index_pkl, 'rb') as f:
+                return pickle.load(f)
+        return {'urls': {}, 'font_dicts': {}}
+
+    def save_index(self, urls=None, font_dicts=None):
+        # urls: {url: sha1}, font_dicts: {sha1: font_dict}, 本次修改的部分
+        with file_lock(self.lock_filename):
+            index = self.load_index()
+            index['urls'].update(urls or {})
+            index['font_dicts'].update(font_dicts or {})
+
+            def dump(tmp):
+                with open(tmp, 'wb') as f:
+                    pickle.dump(index, f)
+
+            atomic_write(self.index_pkl, dump)
+        self.index = index
+
+    def get_hash(self, ttf):
+        return hashlib.sha1(ttf).hexdigest()
+
+    def get_filename(self, ttf_hash):
+        return self.dirname.joinpath('%s.ttf' % ttf_hash)
+
+    def write_ttf(self, ttf_hash, ttf):
+        filename = self.get_filename(ttf_hash)
+        if not filename.exists():
+
+            def dump(tmp):
+                with open(tmp, 'wb') as f:
+                    f.write(ttf)
+
+            atomic_write(filename, dump)
+
+    def get_ttf_by_url(self, url):
+        # 已下载过的url直接读取文件, 否则返回None
+        ttf_hash = self.index['urls'].get(url)
+        if ttf_hash is None:
+            return
+        filename = self.get_filename(ttf_hash)
+        if filename.exists():
+            self.counts['url_hit'] += 1
+            return filename.read_bytes()
+
+    def put_ttf(self, url, ttf):
+        ttf_hash = self.get_hash(ttf)
+        self.write_ttf(ttf_hash, ttf)
+        self.save_index(urls={url: ttf_hash})
+        return ttf_hash
+
+    def get_font_dict(self, ttf):
+        font_dict = self.index['font_dicts'].get(self.get_hash(ttf))
+        if font_dict is not None:
+            self.counts['font_dict_hit'] += 1
+        return font_dict
+
+    def put_font_dicts(self, ttfs, fonts_dict):
+        # ttfs: {k: ttf}, fonts_dict: {k: font_dict}
+        font_dicts = {}
+        for k, font_dict in fonts_dict.items():
+            ttf_hash = self.get_hash(ttfs[k])
+            self.write_ttf(ttf_hash, ttfs[k])
+            font_dicts[ttf_hash] = font_dict
+            self.counts['stored'] += 1
+        if font_dicts:
+            self.save_index(font_dicts=font_dicts)
+
+
+@lru_cache(maxsize=None)
+def get_flatten_pen_class():
+    # fontTools 在使用时才导入
+    from fontTools.pens.basePen import BasePen
+
+    class Flatten_Pen(BasePen):
+        # 曲线按steps段折线化, contours: [np.array (n, 2)]
+        # 每段只有几个点, 用python float计算比numpy快
+        def __init__(self, glyphset=None, steps=4):
+            super().__init__(glyphset)
+            ts = [i / steps for i in range(1, steps + 1)]
+            self.q_coefs = [((1 - t)**2, 2 * (1 - t) * t, t**2) for t in ts]
+            self.c_coefs = [((1 - t)**3, 3 * (1 - t)**2 * t,
+                             3 * (1 - t) * t**2, t**3) for t in ts]
+            self.contours = []
+            self.points = []
+
+        def _moveTo(self, pt):
+            self.points = [pt]
+
+        def _lineTo(self, pt):
+            self.points.append(pt)
+
+        def _qCurveToOne(self, pt1, pt2):
+            (x0, y0), (x1, y1), (x2, y2) = self._getCurrentPoint(), pt1, pt2
+            self.points.extend((a * x0 + b * x1 + c * x2,
+                                a * y0 + b * y1 + c * y2)
+                               for a, b, c in self.q_coefs)
+
+        def _curveToOne(self, pt1, pt2, pt3):
+            (x0, y0), (x1, y1), (x2, y2), (x3, y3) = (self._getCurrentPoint(),
+                                                      pt1, pt2, pt3)
+            self.points.extend((a * x0 + b * x1 + c * x2 + d * x3,
+                                a * y0 + b * y1 + c * y2 + d * y3)
+                               for a, b, c, d in self.c_coefs)
+
+        def _closePath(self):
+            if len(self.points) > 2:
+                self.contours.append(
+                    np.array(self.points, dtype=np.float64).reshape(-1, 2))
+            self.points = []
+
+        _endPath = _closePath
+
+    return Flatten_Pen
+
+
+# 与matplotlib.path.Path的codes相同
+MOVETO, LINETO, CURVE3, CURVE4, CLOSEPOLY = 1, 2, 3, 4, 79
+
+
+@lru_cache(maxsize=None)
+def get_numpy_pen_class():
+    from fontTools.pens.basePen import BasePen
+
+    class Numpy_Pen(BasePen):
+        # 直接写入verts (n, 2), codes (n,), 与SVGPathPen + get_verts_codes的结果相同
+        # - 与当前点重复的直线点跳过
+        # - Z: CLOSEPOLY, 坐标为轮廓起点
+        # - 没有Z的轮廓(endPath)不保留
+        def __init__(self, glyphset=None, capacity=256):
+            super().__init__(glyphset)
+            self.verts = np.empty((capacity, 2), dtype=np.float64)
+            self.codes = np.empty(capacity, dtype=np.uint8)
+            self.n = 0
+            # 每个轮廓的(起始, 结束)
+            self.contours = []
+            self.contour_start = 0
+
+        def _reserve(self, n):
+            if self.n + n > len(self.codes):
+                capacity = max(2 * len(self.codes), self.n + n)
+                self.verts = np.resize(self.verts, (capacity, 2))
+                self.codes = np.resize(self.codes, capacity)
+
+        def _add(self, code, pt):
+            self._reserve(1)
+            self.verts[self.n] = pt
+            self.codes[self.n] = code
+            self.n += 1
+
+        def _moveTo(self, pt):
+            # 未闭合的轮廓丢弃
+            self.n = self.contour_start
+            self._add(MOVETO, pt)
+
+        def _lineTo(self, pt):
+            if tuple(pt) == tuple(self._getCurrentPoint()):
+                return
+            self._add(LINETO, pt)
+
+        def _qCurveToOne(self, pt1, pt2):
+            self._add(CURVE3, pt1)
+            self._add(CURVE3, pt2)
+
+        def _curveToOne(self, pt1, pt2, pt3):
+            self._add(CURVE4, pt1)
+            self._add(CURVE4, pt2)
+            self._add(CURVE4, pt3)
+
+        def _closePath(self):
+            if self.n > self.contour_start:
+                self._add(CLOSEPOLY, self.verts[self.contour_start])
+                self.contours.append((self.contour_start, self.n))
+            self.contour_start = self.n
+
+        def _endPath(self):
+            self.n = self.contour_start
+
+        def get_total_verts_codes(self):
+            # return ([verts], [codes]), 每个轮廓一个array
+            total_verts = [self.verts[i:j] for i, j in self.contours]
+            total_codes = [self.codes[i:j] for i, j in self.contours]
+            return total_verts, total_codes
+
+    return Numpy_Pen
+
+
+def rasterize_contours(contours, bbox, size=32):
+    # even-odd 填充, 在像素中心采样; bbox: (xMin, yMin, xMax, yMax)
+    # return (size, size) bool, 第一行为上方
+    if not contours:
+        return np.zeros((size, size), dtype=bool)
+    xmin, ymin, xmax, ymax = bbox
+    scale = np.array([size / (xmax - xmin), size / (ymax - ymin)])
+    p0 = (np.concatenate(contours) - (xmin, ymin)) * scale
+    p1 = (np.concatenate([np.roll(c, -1, axis=0)
+                          for c in contours]) - (xmin, ymin)) * scale
+    ys = np.arange(size) + 0.5
+    y0, y1 = p0[:, 1], p1[:, 1]
+    # 与每一行像素中心相交的边
+    rows, edges = np.nonzero((y0 <= ys[:, None]) != (y1 <= ys[:, None]))
+    x0, x1 = p0[edges, 0], p1[edges, 0]
+    ey0, ey1 = y0[edges], y1[edges]
+    xs = x0 + (ys[rows] - ey0) * (x1 - x0) / (ey1 - ey0)
+    # 交点右侧的像素中心翻转一次, 第一个为floor(x+0.5), 累加后奇数在内部
+    cols = np.clip(np.floor(xs + 0.5), 0, size).astype(np.intp)
+    flips = np.zeros((size, size + 1), dtype=np.int32)
+    np.add.at(flips, (rows, cols), 1)
+    inside = np.cumsum(flips[:, :size], axis=1) % 2 == 1
+    return inside[::-1]
 
 
 # %%
+class Autohome_Font_Template:
+    # 本地模板匹配, 不需要网络
+    # library: font/template_library.npz, labels (n,) 文字, bitmaps (n, size*size)
+    def __init__(self, size=32, max_distance=0.1) -> None:
+        # max_distance: 不同像素的比例上限, 超过时不识别
+        self.size = size
+        self.max_distance = max_distance
+        self.filename = pathlib.Path('font/template_library.npz')
+        self._library = None
+
+    @property
+    def library(self):
+        if self._library is None:
+            self._library = self.load_library()
+        return self._library
+
+    def load_library(self):
+        if self.filename.exists():
+            with np.load(self.filename) as data:
+                if data['bitmaps'].shape[1] == self.size * self.size:
+                    return {
+                        'labels': data['labels'],
+                        'bitmaps': data['bitmaps'],
+                    }
+        return {
+            'labels': np.array([], dtype=str),
+            'bitmaps': np.zeros((0, self.size * self.size), dtype=bool),
+        }
+
+    def save_library(self):
+        if not self.filename.parent.exists():
+            self.filename.parent.mkdir(parents=True)
+
+        def dump(tmp):
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, **self.library)
+
+        atomic_write(self.filename, dump)
+
+    def rasterize_font(self, font, gnames=None):
+        # return (len(gnames), size*size) bool
+        if gnames is None:
+            gnames = font.getGlyphOrder()[1:]
+        head = font['head']
+        bbox = (head.xMin, head.yMin, head.xMax, head.yMax)
+        glyphset = font.getGlyphSet()
+        Flatten_Pen = get_flatten_pen_class()
+        bitmaps = np.zeros((len(gnames), self.size * self.size), dtype=bool)
+        for i, gname in enumerate(gnames):
+            pen = Flatten_Pen(glyphset)
+            glyphset[gname].draw(pen)
+            bitmaps[i] = rasterize_contours(pen.contours, bbox,
+                                            self.size).ravel()
+        return bitmaps
+
+    def add_font(self, font, font_dict):
+        # font_dict: {文字编码: 文字}, 其他backend的识别结果
+        gnames = [
+            gname for gname in font.getGlyphOrder()[1:]
+            if gname_to_char(gname) in font_dict
+        ]
+        if not gnames:
+            return 0
+        labels = np.array([font_dict[gname_to_char(gname)] for gname in gnames])
+        bitmaps = self.rasterize_font(font, gnames)
+        # 相同的bitmap只保留一个
+        library = self.library
+        labels = np.concatenate([library['labels'], labels])
+        bitmaps = np.concatenate([library['bitmaps'], bitmaps])
+        _, idx = np.unique(np.packbits(bitmaps, axis=1),
+                           axis=0,
+                           return_index=True)
+        idx = np.sort(idx)
+        added = len(idx) - len(library['labels'])
+        self._library = {'labels': labels[idx], 'bitmaps': bitmaps[idx]}
+        return added
+
+    def match_bitmaps(self, bitmaps):
+        # return (最近的文字, 不同像素的比例), 对所有字形一次计算
+        library = self.library
+        if len(library['labels']) == 0:
+            return None, None
+        a = bitmaps.astype(np.float32)
+        b = library['bitmaps'].astype(np.float32)
+        # hamming = |a| + |b| - 2 a·b
+        distances = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - 2 * (
+            a @ b.T)
+        idx = distances.argmin(axis=1)
+        ratios = distances[np.arange(len(idx)), idx] / a.shape[1]
+        return library['labels'][idx], ratios
+
+    def recognize_glyphs(self, fonts, items):
+        # items: [(k, gname)], 所有字形一次匹配
+        # return {(k, gname): 文字}, 只包含距离在max_distance以内的字形
+        gnames_dict = {}
+        for k, gname in items:
+            gnames_dict.setdefault(k, []).append(gname)
+        items = [(k, gname) for k, gnames in gnames_dict.items()
+                 for gname in gnames]
+        if not items:
+            return {}
+        bitmaps = np.concatenate([
+            self.rasterize_font(fonts[k], gnames)
+            for k, gnames in gnames_dict.items()
+        ])
+        labels, ratios = self.match_bitmaps(bitmaps)
+        if labels is None:
+            return {}
+        return {
+            item: str(label)
+            for item, label, ratio in zip(items, labels, ratios)
+            if ratio <= self.max_distance
+        }
+
+    def recognize_font(self, font, gnames=None):
+        # return {gname: 文字}
+        if gnames is None:
+            gnames = font.getGlyphOrder()[1:]
+        recognized = self.recognize_glyphs({0: font},
+                                           [(0, gname) for gname in gnames])
+        return {gname: v for (_, gname), v in recognized.items()} or None
+
+    def generate_fonts_dict(self, fonts):
+        # 识别文字
+        return split_recognized(
+            self.recognize_glyphs(fonts, get_all_items(fonts)))
+
+
 class Autohome_Font_Matplotlib:
+    # 每个字形的宽度(px), 每张图片最多max_glyphs个字形, 不超过百度的最长边4096px
+    tile_pixels = 100
+    max_glyphs = 40
+    # get_nesting_depths 逐对比较的最大轮廓数
+    nesting_pairwise_max = 3
+
     def __init__(self) -> None:
-        self.baidu_orc = Baidu_ORC()
+        self._baidu_orc = None
+        self.font = None
         self.diranme = pathlib.Path('font')
         if not self.diranme.exists():
             self.diranme.mkdir()
 
+    @property
+    def baidu_orc(self):
+        # 第一次识别时获取access_token
+        if self._baidu_orc is None:
+            from baidu_orc import Baidu_ORC
+            self._baidu_orc = Baidu_ORC()
+        return self._baidu_orc
+
     def read_font_from_file(self, filename_ttf):
+        from fontTools.ttLib import TTFont
         font = TTFont(filename_ttf)
         self.get_font_info(font)
 
@@ -50,8 +571,10 @@ class Autohome_Font_Matplotlib:
         self.yMax = self.font['head'].yMax
         glyphorder_table = self.font.getGlyphOrder()
         self.uni_names = glyphorder_table[1:]
+        self.glyphset = self.font.getGlyphSet()
 
     def get_commands_by_uni_name(self, uni_name):
+        from fontTools.pens.svgPathPen import SVGPathPen
         glyphset = self.font.getGlyphSet()
         # 获取pen的基类
         pen = SVGPathPen(glyphset)
@@ -60,6 +583,13 @@ class Autohome_Font_Matplotlib:
         commands = pen._commands
         return commands
 
+    def get_verts_codes_by_uni_name(self, uni_name):
+        # 代替get_commands_by_uni_name + get_total_commands + get_verts_codes
+        # 不生成和解析svg字符串
+        pen = get_numpy_pen_class()(self.glyphset)
+        self.glyphset[uni_name].draw(pen)
+        return pen.get_total_verts_codes()
+
     def get_total_commands(self, commands):
         total_commands = []
         command = []
@@ -75,6 +605,7 @@ class Autohome_Font_Matplotlib:
         return total_commands
 
     def get_verts_codes(self, total_commands):
+        from matplotlib.path import Path
         # 笔的当前位置
         preX = 0.0
         preY = 0.0
@@ -193,14 +724,49 @@ class Autohome_Font_Matplotlib:
                 count += 1
         return count
 
+    def get_nesting_depths(self, paths):
+        # 每个轮廓被其他轮廓包含的次数, 结果与count_path_contains相同
+        # 轮廓k包含i的必要条件: i的bbox在k的bbox内(含边界)
+        # 每个k对所有候选i的顶点只调用一次contains_points
+        # 轮廓数不超过nesting_pairwise_max时逐对比较, 批量的准备开销更大
+        depths = np.zeros(len(paths), dtype=int)
+        if len(paths) < 2:
+            return depths
+        verts = [path.vertices for path in paths]
+        if len(paths) <= self.nesting_pairwise_max:
+            bboxes = [v.min(axis=0).tolist() + v.max(axis=0).tolist()
+                      for v in verts]
+            for i, (x0, y0, x1, y1) in enumerate(bboxes):
+                for k, (a0, b0, a1, b1) in enumerate(bboxes):
+                    if (i != k and a0 <= x0 and b0 <= y0 and
+                            x1 <= a1 and y1 <= b1 and
+                            paths[k].contains_points(verts[i]).all()):
+                        depths[i] += 1
+            return depths
+        mins = np.array([v.min(axis=0) for v in verts])
+        maxs = np.array([v.max(axis=0) for v in verts])
+        # candidates[i, k]
+        candidates = ((mins[:, None] >= mins[None, :]) &
+                      (maxs[:, None] <= maxs[None, :])).all(axis=2)
+        np.fill_diagonal(candidates, False)
+        lengths = np.array([len(v) for v in verts])
+        for k in np.nonzero(candidates.any(axis=0))[0]:
+            idx = np.nonzero(candidates[:, k])[0]
+            inside = paths[k].contains_points(
+                np.concatenate([verts[i] for i in idx]))
+            starts = np.concatenate([[0], np.cumsum(lengths[idx])[:-1]])
+            depths[idx] += np.logical_and.reduceat(inside, starts)
+        return depths
+
     def get_path_plot_dict(self, total_verts, total_codes):
+        from matplotlib.path import Path
         path_dict = {
             i: Path(total_verts[i], total_codes[i])
             for i in range(len(total_verts))
         }
+        depths = self.get_nesting_depths(list(path_dict.values()))
         path_plot_dict = {}
-        for i in path_dict:
-            res = self.count_path_contains(path_dict, i)
+        for i, res in zip(path_dict, depths.tolist()):
             if res in path_plot_dict:
                 path_plot_dict[res].append(path_dict[i])
             else:
@@ -212,6 +778,8 @@ class Autohome_Font_Matplotlib:
         return path_plot_dict
 
     def plot_single_font(self, path_plot_dict, mode='bw'):
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
         # 创建画布窗口
         fig, ax = plt.subplots()
         # 按照'head'表中所有字形的边界框设定x和y轴上下限
@@ -251,9 +819,7 @@ class Autohome_Font_Matplotlib:
         return plt
 
     def plot_by_uni_name(self, uni_name, mode='bw', show=False):
-        commands = self.get_commands_by_uni_name(uni_name)
-        total_commands = self.get_total_commands(commands)
-        total_verts, total_codes = self.get_verts_codes(total_commands)
+        total_verts, total_codes = self.get_verts_codes_by_uni_name(uni_name)
         # points_x, points_y = self.get_contour_points(total_verts) 轮廓点
         path_plot_dict = self.get_path_plot_dict(total_verts, total_codes)
         plt = self.plot_single_font(path_plot_dict, mode)
@@ -264,9 +830,22 @@ class Autohome_Font_Matplotlib:
             plt.show()
         return filename
 
-    def plot_all_in_row(self, path_plot_dict_list, mode='bw', show=False):
+    def plot_all_in_row(self,
+                        path_plot_dict_list,
+                        mode='bw',
+                        show=False,
+                        bboxes=None):
+        # return png的bytes
+        # bboxes: 每个字形所在字体的(xMin, yMin, xMax, yMax), None时使用当前字体
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+        import matplotlib.gridspec as gridspec
         lenth = len(path_plot_dict_list)
-        fig = plt.figure(figsize=(4 * lenth, 4), facecolor='white')
+        if bboxes is None:
+            bboxes = [(self.xMin, self.yMin, self.xMax, self.yMax)] * lenth
+        fig = plt.figure(figsize=(4 * lenth, 4),
+                         dpi=self.tile_pixels / 4,
+                         facecolor='white')
         gs = gridspec.GridSpec(1, lenth, width_ratios=[1] * lenth)
 
         # plt.subplots(1,len(path_plot_dict_list[:10]))
@@ -275,8 +854,9 @@ class Autohome_Font_Matplotlib:
         for idx, path_plot_dict in enumerate(path_plot_dict_list):
             # 按照'head'表中所有字形的边界框设定x和y轴上下限
             ax = plt.subplot(gs[idx])
-            ax.set_xlim(self.xMin, self.xMax)
-            ax.set_ylim(self.yMin, self.yMax)
+            xMin, yMin, xMax, yMax = bboxes[idx]
+            ax.set_xlim(xMin, xMax)
+            ax.set_ylim(yMin, yMax)
             # 不显示坐标
             ax.set_xticks([])
             ax.set_yticks([])
@@ -308,61 +888,71 @@ class Autohome_Font_Matplotlib:
                                                   lw=2)
                         ax.add_patch(patch)
 
-        # 保存图片
-        filename = tempfile.TemporaryFile(delete=False, suffix='.png')
-        plt.savefig(filename.name)
+        # 保存图片, 在内存中
+        bio = BytesIO()
+        plt.savefig(bio, format='png')
         if show:
             plt.show()
-        return filename
+        plt.close(fig)
+        return bio.getvalue()
+
+    def plot_glyphs(self, fonts, items):
+        # items: [(k, gname)], 可以来自不同的字体, 画在同一张图片中
+        path_plot_dict_list = []
+        bboxes = []
+        for k, gname in items:
+            if self.font is not fonts[k]:
+                self.get_font_info(fonts[k])
+            total_verts, total_codes = self.get_verts_codes_by_uni_name(gname)
+            # points_x, points_y = self.get_contour_points(total_verts)
+            path_plot_dict_list.append(
+                self.get_path_plot_dict(total_verts, total_codes))
+            bboxes.append((self.xMin, self.yMin, self.xMax, self.yMax))
+        return self.plot_all_in_row(path_plot_dict_list, 'bw', False, bboxes)
+
+    def recognize_glyphs(self, fonts, items):
+        # items: [(k, gname)], 每max_glyphs个字形一张图片, 并发识别
+        # return {(k, gname): 文字}
+        chunks = [
+            items[i:i + self.max_glyphs]
+            for i in range(0, len(items), self.max_glyphs)
+        ]
+        return recognize_images_by_baidu(self.baidu_orc, chunks,
+                                         partial(self.plot_glyphs, fonts))
+
+    def recognize_font(self, font, gnames=None):
+        # return {gname: 文字}, gnames为None时识别所有字形, 识别失败返回None
+        if gnames is None:
+            gnames = font.getGlyphOrder()[1:]
+        recognized = self.recognize_glyphs({0: font},
+                                           [(0, gname) for gname in gnames])
+        return {gname: v for (_, gname), v in recognized.items()} or None
 
     def generate_fonts_dict(self, fonts):
-        # 识别文字
-        with tqdm(total=len(fonts), desc='recognize texts from baidu') as pbar:
-            fonts_dict = {}
-            for k, font in fonts.items():
-                pbar.update(1)
-                self.get_font_info(font)
-                path_plot_dict_list = []
-                for uni_name in self.uni_names:
-                    commands = self.get_commands_by_uni_name(uni_name)
-                    total_commands = self.get_total_commands(commands)
-                    total_verts, total_codes = self.get_verts_codes(
-                        total_commands)
-                    # points_x, points_y = self.get_contour_points(total_verts)
-                    path_plot_dict = self.get_path_plot_dict(
-                        total_verts, total_codes)
-                    path_plot_dict_list.append(path_plot_dict)
-
-                # 作图
-                im_filename = self.plot_all_in_row(path_plot_dict_list, 'bw',
-                                                   False)
-                baidu_result = self.baidu_orc.general_basic(im_filename.name)
-                im_filename.close()
-                os.remove(im_filename.name)
-
-                gnames = font.getGlyphNames()[1:]
-                # 调整名称为之家文字中的格式, 示例\uede4
-                gname_im_dict = {
-                    eval(r"u'\u" + k[3:] + "'"): None
-                    for k in gnames
-                }
-                if baidu_result is not None:
-                    gname_from_baidu = ''.join(
-                        [w['words'] for w in baidu_result['words_result']])
-                    if len(gname_im_dict) == len(gname_from_baidu):
-                        gname_im_dict_recognized = {
-                            k: v
-                            for k, v in zip(gname_im_dict, gname_from_baidu)
-                        }
-                    fonts_dict[k] = gname_im_dict_recognized
-        return fonts_dict
+        # 识别文字, 所有字体一起请求
+        return split_recognized(
+            self.recognize_glyphs(fonts, get_all_items(fonts)))
 
 
 class Autohome_Font_Freetypepen:
+    # 每张图片最多max_glyphs个字形, 宽度不超过百度的最长边4096px
+    max_glyphs = 40
+    max_width = 4096
+
     def __init__(self) -> None:
-        self.baidu_orc = Baidu_ORC()
+        self._baidu_orc = None
+
+    @property
+    def baidu_orc(self):
+        # 第一次识别时获取access_token
+        if self._baidu_orc is None:
+            from baidu_orc import Baidu_ORC
+            self._baidu_orc = Baidu_ORC()
+        return self._baidu_orc
 
     def freetypepen_plot(self, font, gname, show=False):
+        from fontTools.pens.freetypePen import FreeTypePen
+        from fontTools.misc.transform import Offset
         pen = FreeTypePen(None)  # 实例化Pen子类
         glyph = font.getGlyphSet()[gname]  # 通过字形名称选择某一字形对象
         glyph.draw(pen)  # “画”出字形轮廓
@@ -381,22 +971,18 @@ class Autohome_Font_Freetypepen:
             # print(e)
             return
 
-    def get_font_gname_im_dict(self, font):
+    def get_font_gname_im_dict(self, font, gnames=None):
         # 如果画图错误, 则v=None
-        gnames = font.getGlyphNames()[1:]
+        if gnames is None:
+            gnames = font.getGlyphOrder()[1:]
         gname_im_dict = {
             gname: self.freetypepen_plot(font, gname, show=False)
             for gname in gnames
         }
-
-        # 调整名称为之家文字中的格式, 示例\uede4
-        gname_im_dict = {
-            eval(r"u'\u" + k[3:] + "'"): v
-            for k, v in gname_im_dict.items()
-        }
         return gname_im_dict
 
     def im_bw_transpose(self, im):
+        from PIL import Image
         # 黑白互换
         im_arr = np.array(im)
         im_arr = 255 - im_arr
@@ -404,6 +990,7 @@ class Autohome_Font_Freetypepen:
         return im_bw
 
     def im_put_to_center(self, im, ratio=2):
+        from PIL import Image
         # 居中
         im_center = Image.new(im.mode, im.size, 255)
         ratio_size = tuple((int(i / ratio) for i in im.size))
@@ -412,6 +999,7 @@ class Autohome_Font_Freetypepen:
         return im_center
 
     def im_joint(self, im_1, im_2, flag='x', color='white'):
+        from PIL import Image
         # 拼接
         size_1, size_2 = im_1.size, im_2.size
         if flag == 'x':
@@ -432,6 +1020,7 @@ class Autohome_Font_Freetypepen:
         return joint
 
     def adjust_gname_im_dict(self, gname_im_dict):
+        from PIL import Image
         res_dict = {}
         for k, v in gname_im_dict.items():
             if v is not None:
@@ -439,112 +1028,225 @@ class Autohome_Font_Freetypepen:
                 im = self.im_bw_transpose(im)
                 im = self.im_put_to_center(im)
                 im = im.resize((im.size[0] // 2, im.size[1] // 2),
-                               Image.ANTIALIAS)
+                               Image.LANCZOS)
                 res_dict[k] = im
         return res_dict
 
     def joint_im_for_baidu(self, gname_im_dict):
-        filename = tempfile.TemporaryFile(delete=False, suffix='.png')
+        # return png的bytes, 不写入文件
         im = reduce(lambda left, right: self.im_joint(left, right),
                     [im for im in gname_im_dict.values()])
-        im.save(filename.name)
-        return filename
+        bio = BytesIO()
+        im.save(bio, format='png')
+        return bio.getvalue()
+
+    def recognize_glyphs(self, fonts, items):
+        # items: [(k, gname)], 按宽度拼成尽量少的图片, 并发识别
+        # return {(k, gname): 文字}, 画图错误的字形不识别
+        gnames_dict = {}
+        for k, gname in items:
+            gnames_dict.setdefault(k, []).append(gname)
+        item_im_dict = {}
+        for k, gnames in gnames_dict.items():
+            gname_im_dict = self.get_font_gname_im_dict(fonts[k], gnames)
+            gname_im_dict = self.adjust_gname_im_dict(gname_im_dict)
+            item_im_dict.update({(k, gname): im
+                                 for gname, im in gname_im_dict.items()})
+
+        chunks = []
+        chunk = []
+        width = 0
+        for item, im in item_im_dict.items():
+            if chunk and (len(chunk) >= self.max_glyphs
+                          or width + im.size[0] > self.max_width):
+                chunks.append(chunk)
+                chunk = []
+                width = 0
+            chunk.append(item)
+            width += im.size[0]
+        if chunk:
+            chunks.append(chunk)
+
+        def plot_chunk(chunk):
+            return self.joint_im_for_baidu(
+                {item: item_im_dict[item]
+                 for item in chunk})
+
+        return recognize_images_by_baidu(self.baidu_orc, chunks, plot_chunk)
+
+    def recognize_font(self, font, gnames=None):
+        # return {gname: 文字}, gnames为None时识别所有字形, 识别失败返回None
+        if gnames is None:
+            gnames = font.getGlyphOrder()[1:]
+        recognized = self.recognize_glyphs({0: font},
+                                           [(0, gname) for gname in gnames])
+        return {gname: v for (_, gname), v in recognized.items()} or None
 
     def generate_fonts_dict(self, fonts):
-        # 识别文字
-        with tqdm(total=len(fonts), desc='recognize texts from baidu') as pbar:
-            fonts_dict = {}
-            for k, font in fonts.items():
-                pbar.update(1)
-                gname_im_dict = self.get_font_gname_im_dict(font)
-                gname_im_dict = self.adjust_gname_im_dict(gname_im_dict)
-                im_filename = self.joint_im_for_baidu(gname_im_dict)
-                baidu_result = self.baidu_orc.general_basic(im_filename.name)
-                im_filename.close()
-                os.remove(im_filename.name)
-                if baidu_result is not None:
-                    gname_from_baidu = ''.join(
-                        [w['words'] for w in baidu_result['words_result']])
-                    if len(gname_im_dict) == len(gname_from_baidu):
-                        gname_im_dict_recognized = {
-                            k: v
-                            for k, v in zip(gname_im_dict, gname_from_baidu)
-                        }
-                    fonts_dict[k] = gname_im_dict_recognized
-        return fonts_dict
+        # 识别文字, 所有字体一起请求
+        return split_recognized(
+            self.recognize_glyphs(fonts, get_all_items(fonts)))
 
 
 class Autohome_Font:
-    def __init__(self, backend='matplotlib') -> None:
-        # backend = 'matplotlib' or 'freetypepen'
+    def __init__(self,
+                 backend='matplotlib',
+                 glyph_cache=True,
+                 ttf_cache=True) -> None:
+        # backend = 'matplotlib' or 'freetypepen' or 'template'
+        # glyph_cache: 使用font/glyph_cache.pkl, 只识别没见过的字形
+        # ttf_cache: True时使用font/ttf, 识别过的ttf不读取字体
+        #            也可以传入Ttf_Cache实例, 与Autohome_BBS共用
         self.backend = backend
         self.backend_matplotlib = Autohome_Font_Matplotlib()
         self.backend_freetypepen = Autohome_Font_Freetypepen()
+        self.backend_template = Autohome_Font_Template()
+        self.glyph_cache = Glyph_Cache() if glyph_cache else None
+        if isinstance(ttf_cache, Ttf_Cache):
+            self.ttf_cache = ttf_cache
+        else:
+            self.ttf_cache = Ttf_Cache() if ttf_cache else None
 
-    def read_font_from_biz_content(self, biz_content):
-        # 读取font到字典, 键与biz_content['biz_ttfs]一致
+    def read_font_from_ttfs(self, ttfs):
+        from fontTools.ttLib import TTFont
+        # 读取font到字典, 键与ttfs一致
         fonts = {}
-        for k, v in biz_content['biz_ttfs'].items():
+        for k, v in ttfs.items():
             bio = BytesIO()
             bio.write(v)
             fonts[k] = TTFont(bio)
         return fonts
 
+    def read_font_from_biz_content(self, biz_content):
+        # 读取font到字典, 键与biz_content['biz_ttfs]一致
+        return self.read_font_from_ttfs(biz_content['biz_ttfs'])
+
+    def get_backend(self):
+        if self.backend == 'matplotlib':
+            return self.backend_matplotlib
+        elif self.backend == 'freetypepen':
+            return self.backend_freetypepen
+        elif self.backend == 'template':
+            return self.backend_template
+
     def generate_fonts_dict(self, fonts):
         # 识别文字
 
         print('backend is %s' % self.backend)
-        fonts_dict = None
-        if self.backend == 'matplotlib':
-            fonts_dict = self.backend_matplotlib.generate_fonts_dict(fonts)
+        backend = self.get_backend()
+        if backend is None:
+            return
+        if self.glyph_cache is None:
+            return backend.generate_fonts_dict(fonts)
 
-        elif self.backend == 'freetypepen':
-            fonts_dict = self.backend_freetypepen.generate_fonts_dict(fonts)
+        # 只识别缓存中没有的字形, 所有字体一起识别
+        t0 = time.time()
+        fonts_fingerprints = {
+            k: fingerprint_font(font)
+            for k, font in fonts.items()
+        }
+        unseen = self.glyph_cache.get_unseen(fonts_fingerprints)
+        items = [(k, gname) for k, gnames in unseen.items()
+                 for gname in gnames]
+        if items:
+            recognized = backend.recognize_glyphs(fonts, items)
+            self.glyph_cache.update({
+                fonts_fingerprints[k][gname]: v
+                for (k, gname), v in recognized.items()
+            })
+            self.glyph_cache.save()
 
+        fonts_dict = {
+            k: self.glyph_cache.get_font_dict(fingerprints)
+            for k, fingerprints in fonts_fingerprints.items()
+        }
+        print('glyph cache: %s fonts, %s glyphs recognized, %s, %.3fs' %
+              (len(fonts), len(items), dict(self.glyph_cache.counts),
+               time.time() - t0))
         return fonts_dict
 
-    def replace_df_biz_replies_with_font(self, reply_content, page,
-                                         fonts_dict):
-        font_dict = fonts_dict[page]
-        regex = re.compile('|'.join(map(re.escape, font_dict)))
-        reply_content = regex.sub(lambda m: font_dict[m.group(0)],
-                                  reply_content)
-        return reply_content
+    def generate_fonts_dict_from_ttfs(self, ttfs):
+        # ttfs: {k: ttf bytes}, ttf_cache中有的直接返回, 其余读取字体后识别
+        # self.fonts 为本次读取的字体
+        ttfs = {k: ttf for k, ttf in ttfs.items() if ttf is not None}
+        fonts_dict = {}
+        ttfs_unknown = {}
+        for k, ttf in ttfs.items():
+            font_dict = None
+            if self.ttf_cache is not None:
+                font_dict = self.ttf_cache.get_font_dict(ttf)
+            if font_dict is None:
+                ttfs_unknown[k] = ttf
+            else:
+                fonts_dict[k] = font_dict
+        self.fonts = self.read_font_from_ttfs(ttfs_unknown)
+        if self.fonts:
+            fonts_dict.update(self.generate_fonts_dict(self.fonts) or {})
+            if self.ttf_cache is not None:
+                # 只保存全部字形都识别的字体
+                self.ttf_cache.put_font_dicts(
+                    ttfs, {
+                        k: fonts_dict[k]
+                        for k, font in self.fonts.items()
+                        if len(fonts_dict.get(k, {})) == len(
+                            font.getGlyphOrder()) - 1
+                    })
+        if self.ttf_cache is not None:
+            print('ttf cache: %s ttfs, %s' %
+                  (len(ttfs), dict(self.ttf_cache.counts)))
+        return fonts_dict
+
+    def update_template_library(self, fonts=None, fonts_dict=None):
+        # 用识别结果更新template backend的bitmap库, 默认为最近一次replace_biz_content
+        if fonts is None:
+            fonts, fonts_dict = self.fonts, self.fonts_dict
+        added = 0
+        for k, font in fonts.items():
+            if fonts_dict and fonts_dict.get(k):
+                added += self.backend_template.add_font(font, fonts_dict[k])
+        if added:
+            self.backend_template.save_library()
+        print('template library: %s added, %s total' %
+              (added, len(self.backend_template.library['labels'])))
+        return added
+
+    def get_translate_tables(self, fonts_dict):
+        # 每个page一个str.maketrans表, 文字编码都是单个字符
+        return {
+            page: str.maketrans(font_dict)
+            for page, font_dict in fonts_dict.items()
+        }
 
     def replace_biz_content_by_fonts_dict(self, biz_content, fonts_dict):
-        # 反向替换
-        font_dict = fonts_dict[1]
-        regex = re.compile('|'.join(map(re.escape, font_dict)))
+        # 反向替换, 正文和图片使用第1页的字体, 回复使用所在page的字体
+        # 没有字体的page不替换
+        tables = self.get_translate_tables(fonts_dict)
+        table = tables.get(1, {})
 
         # 替换biz_contents
         biz_contents = biz_content['biz_contents']
-        biz_contents = [
-            regex.sub(lambda m: font_dict[m.group(0)], content)
-            for content in biz_contents
-        ]
+        biz_contents = [content.translate(table) for content in biz_contents]
         biz_content['biz_contents'] = biz_contents
 
         # 替换df_biz_imgs
         df_biz_imgs = biz_content['df_biz_imgs']
-        df_biz_imgs['img_text'] = df_biz_imgs['img_text'].apply(
-            lambda content: regex.sub(lambda m: font_dict[m.group(0)], content
-                                      ))
+        df_biz_imgs['img_text'] = df_biz_imgs['img_text'].str.translate(table)
         biz_content['df_biz_imgs'] = df_biz_imgs
 
-        # 替换df_biz_replies
+        # 替换df_biz_replies, 按page分组
         df_biz_replies = biz_content['df_biz_replies']
-        df_biz_replies['reply_content'] = df_biz_replies[[
-            'reply_content', 'page'
-        ]].apply(lambda row: self.replace_df_biz_replies_with_font(
-            row['reply_content'], row['page'], fonts_dict),
-                 axis=1)
+        for page, index in df_biz_replies.groupby('page').groups.items():
+            if page in tables:
+                replies = df_biz_replies.loc[index, 'reply_content']
+                df_biz_replies.loc[index, 'reply_content'] = (
+                    replies.str.translate(tables[page]))
         biz_content['df_biz_replies'] = df_biz_replies
 
         return biz_content
 
     def replace_biz_content(self, biz_content):
-        self.fonts = self.read_font_from_biz_content(biz_content)
-        self.fonts_dict = self.generate_fonts_dict(self.fonts)
+        self.fonts_dict = self.generate_fonts_dict_from_ttfs(
+            biz_content['biz_ttfs'])
         biz_content = self.replace_biz_content_by_fonts_dict(
             biz_content, self.fonts_dict)
 
@@ -556,6 +1258,24 @@ class Autohome_Font:
         print('-' * 40)
         return biz_content
 
+    def replace_biz_contents(self, biz_contents):
+        # 多个帖子的字体一起识别, ttfs的键为(序号, page)
+        ttfs = {}
+        for i, biz_content in enumerate(biz_contents):
+            for page, ttf in biz_content['biz_ttfs'].items():
+                ttfs[(i, page)] = ttf
+        fonts_dict = self.generate_fonts_dict_from_ttfs(ttfs)
+        results = []
+        for i, biz_content in enumerate(biz_contents):
+            biz_fonts_dict = {
+                page: font_dict
+                for (j, page), font_dict in fonts_dict.items() if j == i
+            }
+            results.append(
+                self.replace_biz_content_by_fonts_dict(
+                    biz_content, biz_fonts_dict))
+        return results
+
 
 # %%
 if __name__ == '__main__':
@@ -566,5 +1286,139 @@ if __name__ == '__main__':
     self = Autohome_Font(backend='matplotlib')
     biz_content = self.replace_biz_content(biz_content)
 
+# %%
+# translate表与逐行正则替换的结果比较
+if __name__ == '__main__':
+    biz_content = pickle.load(open('./output/bbs/biz/102697565.pkl', 'rb'))
+    self = Autohome_Font(backend='matplotlib')
+    fonts_dict = self.generate_fonts_dict_from_ttfs(biz_content['biz_ttfs'])
+    df_biz_replies = biz_content['df_biz_replies'].copy()
+
+    t0 = time.time()
+
+    def replace_by_regex(row):
+        font_dict = fonts_dict[row['page']]
+        regex = re.compile('|'.join(map(re.escape, font_dict)))
+        return regex.sub(lambda m: font_dict[m.group(0)], row['reply_content'])
+
+    expected = df_biz_replies.apply(replace_by_regex, axis=1)
+    t1 = time.time()
+    biz_content = self.replace_biz_content_by_fonts_dict(
+        biz_content, fonts_dict)
+    t2 = time.time()
+    assert biz_content['df_biz_replies']['reply_content'].tolist(
+    ) == expected.tolist()
+    print('regex %.3fs, translate %.3fs' % (t1 - t0, t2 - t1))
+
+# %%
+# 轮廓嵌套层数: get_nesting_depths 与 count_path_contains 比较
+# 合成字形: 随机圆形轮廓, 部分带同心内圈; 有biz pkl时加入真实字体
+if __name__ == '__main__':
+    from matplotlib.path import Path
+    self = Autohome_Font()
+    backend = self.backend_matplotlib
+
+    def get_circle_path(cx, cy, r, n=30):
+        t = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        verts = np.c_[cx + r * np.cos(t), cy + r * np.sin(t)]
+        verts = np.vstack([verts, verts[:1]])
+        codes = [Path.MOVETO] + [Path.LINETO] * (n - 1) + [Path.CLOSEPOLY]
+        return Path(verts, codes)
+
+    rng = np.random.default_rng(0)
+    paths_list = []
+    for _ in range(600):
+        paths = []
+        # 1~3个轮廓走逐对比较, 更多走批量
+        for _ in range(rng.integers(1, 12)):
+            cx, cy = rng.uniform(0, 1000, 2)
+            r = rng.uniform(30, 300)
+            paths.append(get_circle_path(cx, cy, r))
+            for k in range(rng.integers(0, 3)):
+                paths.append(get_circle_path(cx, cy, r / (k + 2)))
+        paths_list.append(paths)
+    filename = './output/bbs/biz/102697565.pkl'
+    if pathlib.Path(filename).exists():
+        biz_content = pickle.load(open(filename, 'rb'))
+        fonts = self.read_font_from_biz_content(biz_content)
+        for font in fonts.values():
+            backend.get_font_info(font)
+            for uni_name in backend.uni_names:
+                total_verts, total_codes = \
+                    backend.get_verts_codes_by_uni_name(uni_name)
+                paths_list.append([
+                    Path(verts, codes)
+                    for verts, codes in zip(total_verts, total_codes)
+                ])
+    t0 = time.time()
+    depths_list = [backend.get_nesting_depths(paths) for paths in paths_list]
+    t1 = time.time()
+    counts_list = [[
+        backend.count_path_contains(dict(enumerate(paths)), i)
+        for i in range(len(paths))
+    ] for paths in paths_list]
+    t2 = time.time()
+    # 层数相同则get_path_plot_dict的填充相同
+    for depths, counts in zip(depths_list, counts_list):
+        assert depths.tolist() == counts
+    print('%s glyphs, get_nesting_depths %.3fs, count_path_contains %.3fs' %
+          (len(paths_list), t1 - t0, t2 - t1))
+
+# %%
+# Numpy_Pen 与 SVGPathPen字符串解析的结果比较
+if __name__ == '__main__':
+    biz_content = pickle.load(open('./output/bbs/biz/102697565.pkl', 'rb'))
+    self = Autohome_Font()
+    backend = self.backend_matplotlib
+    fonts = self.read_font_from_biz_content(biz_content)
+    t_svg = t_numpy = 0
+    for font in fonts.values():
+        backend.get_font_info(font)
+        for uni_name in backend.uni_names:
+            t0 = time.time()
+            commands = backend.get_commands_by_uni_name(uni_name)
+            total_verts, total_codes = backend.get_verts_codes(
+                backend.get_total_commands(commands))
+            t1 = time.time()
+            verts_numpy, codes_numpy = backend.get_verts_codes_by_uni_name(
+                uni_name)
+            t2 = time.time()
+            t_svg += t1 - t0
+            t_numpy += t2 - t1
+            assert len(total_verts) == len(verts_numpy)
+            for verts, codes, v, c in zip(total_verts, total_codes,
+                                          verts_numpy, codes_numpy):
+                assert np.array_equal(np.array(verts), v)
+                assert np.array_equal(np.array(codes), c)
+    print('svg %.3fs, numpy pen %.3fs' % (t_svg, t_numpy))
+
+# %%
+# 由百度识别结果生成template库, 再用template backend识别并比较
+if __name__ == '__main__':
+    biz_content = pickle.load(open('./output/bbs/biz/102697565.pkl', 'rb'))
+    self = Autohome_Font(backend='matplotlib', glyph_cache=False)
+    fonts = self.read_font_from_biz_content(biz_content)
+    fonts_dict = self.generate_fonts_dict(fonts)
+    self.update_template_library(fonts, fonts_dict)
+
+    backend = self.backend_template
+    t0 = time.time()
+    fonts_dict_template = backend.generate_fonts_dict(fonts)
+    n = sum(len(font.getGlyphOrder()) - 1 for font in fonts.values())
+    print('%s glyphs, %.0f glyphs/s' % (n, n / (time.time() - t0)))
+    for k in fonts_dict:
+        same = sum(fonts_dict_template[k].get(c) == v
+                   for c, v in fonts_dict[k].items())
+        print(k, same, len(fonts_dict[k]))
+
+# %%
+# 缓存预热后再次识别, 不请求百度
+if __name__ == '__main__':
+    biz_content = pickle.load(open('./output/bbs/biz/102697565.pkl', 'rb'))
+    self = Autohome_Font(backend='matplotlib')
+    fonts = self.read_font_from_biz_content(biz_content)
+    fonts_dict = self.generate_fonts_dict(fonts)
+    assert self.glyph_cache.counts['miss'] == 0, self.glyph_cache.counts
+
 # %%
 # %%
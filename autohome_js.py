@@ -0,0 +1,112 @@
+# %%[markdown]
+# 常驻node进程池, 代替每次运行js都启动新的解释器
+# - Js_Runtime_Pool(size): size个node进程, stdin/stdout 每行一个json
+# - 每次在新的vm context中运行, 互不影响
+# - eval_var(js, var): 运行js后返回var的值, 阻塞调用, 在线程池中运行不阻塞事件循环
+# - 没有安装node时 is_available() 为False, 调用方使用js_return_var
+
+# %%
+import json
+import queue
+import shutil
+import threading
+import subprocess
+
+node_driver = r'''
+const vm = require('vm');
+const readline = require('readline');
+const rl = readline.createInterface({input: process.stdin});
+rl.on('line', (line) => {
+  let out;
+  try {
+    const req = JSON.parse(line);
+    const value = vm.runInNewContext(req.js + '\n;' + req.var, {},
+                                     {timeout: req.timeout});
+    out = {value: value === undefined ? null : value};
+  } catch (e) {
+    out = {error: String(e)};
+  }
+  process.stdout.write(JSON.stringify(out) + '\n');
+});
+'''
+
+
+# %%
+class Js_Runtime_Pool:
+    def __init__(self, size=4, node=None, timeout=10):
+        # timeout: 每次运行的秒数上限
+        self.size = size
+        self.node = node or shutil.which('node')
+        self.timeout = timeout
+        self.processes = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return self.node is not None
+
+    def start_process(self):
+        return subprocess.Popen([self.node, '-e', node_driver],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                text=True,
+                                encoding='utf-8',
+                                bufsize=1)
+
+    def start(self):
+        # 第一次调用时启动进程
+        with self.lock:
+            while len(self.processes) < self.size:
+                process = self.start_process()
+                self.processes.append(process)
+                self.idle.put(process)
+
+    def restart_process(self, process):
+        process.kill()
+        with self.lock:
+            self.processes.remove(process)
+            process = self.start_process()
+            self.processes.append(process)
+        return process
+
+    def eval_var(self, js, var):
+        if not self.processes:
+            self.start()
+        process = self.idle.get()
+        try:
+            process.stdin.write(
+                json.dumps({
+                    'js': js,
+                    'var': var,
+                    'timeout': int(self.timeout * 1000)
+                }) + '\n')
+            process.stdin.flush()
+            line = process.stdout.readline()
+        except OSError:
+            line = ''
+        if not line:
+            # 进程已退出
+            self.idle.put(self.restart_process(process))
+            raise RuntimeError('node process exited')
+        self.idle.put(process)
+        out = json.loads(line)
+        if 'error' in out:
+            raise RuntimeError(out['error'])
+        return out['value']
+
+    def close(self):
+        with self.lock:
+            for process in self.processes:
+                process.kill()
+                process.wait()
+            self.processes = []
+            self.idle = queue.Queue()
+
+
+# %%
+if __name__ == '__main__':
+    self = Js_Runtime_Pool(size=2)
+    print(self.eval_var("var rules = ''; rules = rules + 'a' + '#b';",
+                        'rules'))
+    self.close()
+# %%
@@ -2,6 +2,11 @@
 # --- 20220721: 更换bsobj解析库为html5lib
 # - cmd > pip install html5lib
 # - bsobj = bs4.BeautifulSoup(response.content, features='html5lib')
+# --- 更换默认解析库为lxml, html5lib仅作为后备
+# - 解析行数少于series-count或有行解析失败时, 使用html5lib重新解析
+# - Autohome_Model(parser='html.parser') 可更换解析库
+# --- 解析函数移到模块级, 只依赖content, 返回纯数据
+# - Autohome_Model(parse_workers=4) 在进程池中解析, 默认在事件循环中解析
 
 
 # %%
@@ -11,20 +16,186 @@ import time
 import bs4
 import logging
 import string
+from functools import partial
 import pandas as pd
 from pyquery import PyQuery as pq
-from tqdm.auto import tqdm
-
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 
 from async_spider import Async_Spider
+from autohome_spider import Autohome_Spider_Mixin
+from autohome_catalog import get_catalog
+from autohome_context import get_context
+
+# %%
+# 模块级解析函数, 可pickle, 供ProcessPoolExecutor使用
+url_model = 'https://www.autohome.com.cn/%s/'
+bm_compile = re.compile(r'.*?/brand-(\d*)-(\d*).*?.html.*')
+brand_compile = re.compile(r'.*?/brand-(\d*).*?.html.*')
+logger = logging.getLogger(__name__)
+
+
+def make_bsobj(content, features='lxml'):
+    return bs4.BeautifulSoup(content, features=features)
+
+
+def fetch_lis_from_bsobj(bsobj, lis_type='.rank-list-ul'):
+    # lis_type = '.rank-list-ul' or lis_type = '.rank-img-ul'
+    uls_list = bsobj.select(lis_type)
+    lis_list = []
+    for ul in uls_list:
+        lis_list += ul.select('li')
+    lis_list = [li for li in lis_list if li.attrs.get('id')]
+    return lis_list
+
+
+def fetch_series_count_from_bsobj(bsobj):
+    count = bsobj.select_one('#series-count')
+    if count:
+        result = int(count.text)
+        return result
+
+
+def fetch_data_from_bsobj(bsobj, lis_type='.rank-list-ul', logger=logger):
+    # ul > li > h4
+    data = []
+    # ul_img 比ul_list多图片信息
+    # ul_img 动态加载了...
+    # uls_img = bsobj.select('.rank-img-ul')
+    # lis_img = []
+    # for ul in uls_img:
+    #     lis_img += ul.select('li')
+    # lis_img = [li for li in lis_img if li.attrs.get('id')]
+
+    lis_list = fetch_lis_from_bsobj(bsobj, lis_type=lis_type)
+
+    for li in lis_list:
+        try:
+            li_h4 = li.find('h4')
+            li_h4_a = li.find('a')
+            li_h4_sibling_sibling = li_h4.next_sibling.next_sibling
+            li_img = li.find('img')
+            li_parent_previous_sibling = li.parent.find_previous_sibling()
+            li_parent_parent_parent_dt = li.parent.parent.parent.dt
+
+            model_id = li.attrs['id'].replace('s', '')
+            model_name = li_h4_a.text
+            model_status = True if li_h4_a.attrs.get('class') else False
+            if hasattr(li_h4_sibling_sibling, 'text'):
+                model_price = li_h4_sibling_sibling.text
+            else:
+                model_price = li_h4_sibling_sibling.__str__()
+            model_url = url_model % model_id
+            if li_img:
+                model_picture_url = 'https:%s' % li_img.attrs.get(
+                    'data-original')
+            else:
+                model_picture_url = ''
+            brand_id, manu_id = bm_compile.match(
+                li_parent_previous_sibling.a['href']).groups()
+            manu_name = li_parent_previous_sibling.text
+            brand_name = li_parent_parent_parent_dt.text.strip()
+
+            data.append([
+                model_id,
+                model_name,
+                model_price,
+                model_status,
+                model_url,
+                model_picture_url,
+                manu_id,
+                manu_name,
+                brand_id,
+                brand_name,
+            ])
+        except Exception as e:
+            logger.warning(e)
+    return data
+
+
+def check_data_from_bsobj(bsobj, data, lis_type='.rank-list-ul'):
+    # 行数检查, 不通过时需要html5lib重新解析
+    # 1. 解析行数不少于series-count
+    # 2. 每个li都成功解析
+    lis_list = fetch_lis_from_bsobj(bsobj, lis_type=lis_type)
+    count = fetch_series_count_from_bsobj(bsobj)
+    if count is not None and len(data) < count:
+        return False
+    if len(lis_list) == 0 or len(data) < len(lis_list):
+        return False
+    return True
+
+
+def fetch_bsobj_data_from_content(content,
+                                  lis_type='.rank-list-ul',
+                                  parser='lxml',
+                                  logger=logger):
+    # 返回通过行数检查的bsobj, data 及实际使用的解析库
+    bsobj = make_bsobj(content, features=parser)
+    data = fetch_data_from_bsobj(bsobj, lis_type=lis_type, logger=logger)
+    if parser != 'html5lib' and not check_data_from_bsobj(
+            bsobj, data, lis_type=lis_type):
+        parser = 'html5lib'
+        bsobj = make_bsobj(content, features=parser)
+        data = fetch_data_from_bsobj(bsobj, lis_type=lis_type, logger=logger)
+    return bsobj, data, parser
+
+
+def fetch_brand_manu_dict_from_bsobj(bsobj, brand_dict, manu_dict):
+    # 更新brand_dict, manu_dict, 没有dl[olr]时返回False
+    dls = [
+        dl for dl in bsobj.find_all('dl')
+        if dl.attrs.get('id') and dl.attrs.get('olr')
+    ]
+    if len(dls) == 0:
+        return False
+
+    for dl in dls:
+        # 更新brand_dict
+        div_brand = dl.div
+        try:
+            brand_name = div_brand.text
+            brand_id = brand_compile.match(
+                div_brand.a.attrs['href']).groups()[0]
+            brand_dict |= {brand_id: brand_name}
+        except:
+            pass
+        # 更新manu_dict
+        divs_manu = dl.find_all('div', {'class': 'h3-tit'})
+        for div_manu in divs_manu:
+            try:
+                manu_name = div_manu.text
+                manu_id = bm_compile.match(
+                    div_manu.a.attrs['href']).groups()[1]
+                manu_dict |= {manu_id: manu_name}
+            except:
+                pass
+    return True
+
+
+def fetch_page_from_content(content,
+                            lis_type='.rank-img-ul',
+                            parser='lxml',
+                            brand_manu=True):
+    # 页面一次解析, 返回 {'data', 'brand_dict', 'manu_dict', 'parser'}
+    # data 不含segment_id, segment_name
+    bsobj, data, parser = fetch_bsobj_data_from_content(content,
+                                                        lis_type=lis_type,
+                                                        parser=parser)
+    page = {
+        'data': data,
+        'brand_dict': {},
+        'manu_dict': {},
+        'parser': parser,
+    }
+    if brand_manu:
+        fetch_brand_manu_dict_from_bsobj(bsobj, page['brand_dict'],
+                                         page['manu_dict'])
+    return page
+
 
 # %%
 
 
-class Autohome_Segment(Async_Spider):
+class Autohome_Segment(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_segment'
 
     # 轻型卡车页面不在默认级别中
@@ -108,15 +279,20 @@ class Autohome_Segment(Async_Spider):
         return df_segment
 
 
-class Autohome_Model(Async_Spider):
+class Autohome_Model(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_model'
 
     def __init__(self, max_retry=3, concurrency=100, threading_init_driver=False,
-                 logging_level=logging.ERROR, verbose=True):
+                 logging_level=logging.ERROR, verbose=True, parser='lxml',
+                 parse_workers=None):
         super().__init__(max_retry=max_retry,
                          concurrency=concurrency,
                          threading_init_driver=threading_init_driver,
                          logging_level=logging_level)
+        # parser: bs4解析库, 'lxml', 'html.parser' 或 'html5lib'
+        self.parser = parser
+        # parse_workers: 解析进程数, None 在事件循环中解析
+        self.parse_workers = parse_workers
         self.init_preparetion(verbose=verbose)
 
     def init_preparetion(self, verbose=True):
@@ -162,6 +338,11 @@ class Autohome_Model(Async_Spider):
             for msg in msgs:
                 print(msg)
 
+    @property
+    def catalog(self):
+        # 反向查询索引, 源文件变化时自动重建
+        return get_catalog(self.dirname_output)
+
     def init_df_segments(self, force=True):
         autohome_segment = Autohome_Segment(verbose=False)
         self.df_segments = autohome_segment.get_df_segments(force=force,
@@ -185,6 +366,7 @@ class Autohome_Model(Async_Spider):
         df_result = df_result[~pd.isna(df_result).all(axis=1)]
         df_result = df_result.reset_index(drop=True)
         df_result.to_pickle(self.result_pkl)
+        get_context(self.dirname_output).update(df_models=df_result)
         if clipboard:
             self.df_to_clipboard(df_result)
         return df_result
@@ -237,25 +419,28 @@ class Autohome_Model(Async_Spider):
     def get_df_all_models_by_letter(self, save=True, opencsv=True):
         # 20220721 更新
         # 通过字母页面更新所有车型
+        lis_type = '.rank-img-ul'
         coroutines = [self.async_get_response(
             self.url_img_by_letter % l) for l in string.ascii_uppercase]
-        tasks = self.run_async_loop(coroutines, tqdm_desc='get_df_all_models')
-        results = [task.result() for task in tasks]
-        responses = [result for result in results if result]
-
-        lis_type = '.rank-img-ul'
 
-        datas = [self.fetch_data_from_response(
-            response, lis_type=lis_type) for response in responses]
-        df_datas = [pd.DataFrame(data, columns=self.result_columns)
-                    for data in datas]
+        # 每个页面只解析一次, 同时获取车型数据和brand_dict, manu_dict
+        results = self.run_async_pipeline(
+            coroutines,
+            self.add_segment_to_page,
+            tqdm_desc='get_df_all_models',
+            content_func=partial(fetch_page_from_content,
+                                 lis_type=lis_type,
+                                 parser=self.parser))
+        pages = [page for page in results if page]
+        df_datas = [pd.DataFrame(page['data'], columns=self.result_columns)
+                    for page in pages if page['data']]
 
         self.brand_dict = {}
         self.manu_dict = {}
         print('update brand_dict and manu_dict')
-        for response in responses:
-            self.update_brand_manu_dict(
-                response, self.brand_dict, self.manu_dict)
+        for page in pages:
+            self.brand_dict |= page['brand_dict']
+            self.manu_dict |= page['manu_dict']
         with open(self.brand_dict_pkl, 'wb') as f:
             pickle.dump(self.brand_dict, f)
         with open(self.manu_dict_pkl, 'wb') as f:
@@ -267,32 +452,7 @@ class Autohome_Model(Async_Spider):
                 subset=['model_id'], keep='first')
             # 更新segment_id, segment_name
             df_exist = self.read_exist_data(False)
-            self.segment_dict = {
-                k: v
-                for k, v in df_models[['segment_id', 'segment_name'
-                                       ]].drop_duplicates().values
-            }
-            df_all_models['segment_id'] = df_all_models['model_id'].apply(
-                lambda key: self.df_vlookup(
-                    df_exist, 'model_id', 'segment_id', key, top=True))
-            df_all_models['segment_name'] = df_all_models['model_id'].apply(
-                lambda key: self.df_vlookup(
-                    df_exist, 'model_id', 'segment_name', key, top=True))
-
-            # 判断是否有遗留任务
-            df_misses = df_all_models[pd.isna(
-                df_all_models['segment_id'])].copy()
-            if len(df_misses):
-                df_misses['segment_id'] = df_misses['model_url'].apply(
-                    lambda x: self.get_segment_id_from_url(x))
-                df_misses['segment_name'] = df_misses['segment_id'].apply(
-                    lambda x: self.segment_dict.get(x))
-
-                df_result = pd.concat([df_all_models, df_misses])
-                df_result = df_result.drop_duplicates(
-                    subset=['model_id'], keep='last')
-            else:
-                df_result = df_exist
+            df_result = self.backfill_segment(df_all_models, df_exist)
 
             # 保存
             if save:
@@ -329,17 +489,31 @@ class Autohome_Model(Async_Spider):
                 },
                 max_retry=self.max_retry,
             ))
-        tasks = self.run_async_loop(coroutines, tqdm_desc='async_get_model')
+        # 边下载边解析, 只保留没有数据的response, 交给selenium处理
+        def parse_func(response, page):
+            data = self.add_segment_to_page(response, page)['data']
+            if data:
+                return data, None
+            return None, response
+
+        results = self.run_async_pipeline(
+            coroutines,
+            parse_func,
+            tqdm_desc='async_get_model',
+            content_func=partial(fetch_page_from_content,
+                                 lis_type=lis_type,
+                                 parser=self.parser,
+                                 brand_manu=False))
 
         datas = []
         responses_miss = []
-        for task in tasks:
-            data = self.fetch_data_from_response(
-                task.result(), lis_type=lis_type)
+        for result in results:
+            if result is None:
+                continue
+            data, response = result
             if data:
                 datas.append(data)
             else:
-                response = task.result()
                 responses_miss.append(response)
 
         for response in responses_miss:
@@ -360,10 +534,49 @@ class Autohome_Model(Async_Spider):
 
         return df_models
 
+    def make_bsobj(self, content, features=None):
+        # 默认使用self.parser
+        if features is None:
+            features = self.parser
+        return make_bsobj(content, features=features)
+
+    def check_data_from_bsobj(self, bsobj, data, lis_type='.rank-list-ul'):
+        return check_data_from_bsobj(bsobj, data, lis_type=lis_type)
+
+    def fetch_bsobj_data_from_response(self, response,
+                                       lis_type='.rank-list-ul'):
+        # 返回通过行数检查的bsobj和data
+        bsobj, data, parser = fetch_bsobj_data_from_content(
+            response.content,
+            lis_type=lis_type,
+            parser=self.parser,
+            logger=self.logger)
+        if parser != self.parser:
+            print('fallback to html5lib: %s' % response.url)
+        return bsobj, data
+
+    def fetch_page_from_response(self, response, lis_type='.rank-img-ul'):
+        # 字母页面一次解析, 返回车型数据和brand_dict, manu_dict
+        print('process page of response from url:%s' % response.url)
+        page = fetch_page_from_content(response.content,
+                                       lis_type=lis_type,
+                                       parser=self.parser)
+        return self.add_segment_to_page(response, page)
+
+    def add_segment_to_page(self, response, page):
+        # page 来自fetch_page_from_content, 可能在其他进程中解析
+        if page['parser'] != self.parser:
+            print('fallback to html5lib: %s' % response.url)
+        page['data'] = self.add_segment_to_data(response, page['data'])
+        return page
+
     def fetch_data_from_response(self, response, lis_type='.rank-list-ul'):
         print('process data of response from url:%s' % response.url)
-        bsobj = bs4.BeautifulSoup(response.content, features='html5lib')
-        data = self.fetch_data_from_bsobj(bsobj, lis_type=lis_type)
+        _, data = self.fetch_bsobj_data_from_response(response,
+                                                      lis_type=lis_type)
+        return self.add_segment_to_data(response, data)
+
+    def add_segment_to_data(self, response, data):
         if len(data):
             if hasattr(response, 'meta'):
                 segment_id = response.meta['segment_id']
@@ -375,70 +588,18 @@ class Autohome_Model(Async_Spider):
             return data
 
     def fetch_data_from_bsobj(self, bsobj, lis_type='.rank-list-ul'):
-        # ul > li > h4
-        data = []
-        bm_compile = re.compile(r'.*?/brand-(\d*)-(\d*).*?.html.*')
-        # ul_img 比ul_list多图片信息
-        # ul_img 动态加载了...
-        # uls_img = bsobj.select('.rank-img-ul')
-        # lis_img = []
-        # for ul in uls_img:
-        #     lis_img += ul.select('li')
-        # lis_img = [li for li in lis_img if li.attrs.get('id')]
-
-        lis_list = self.fetch_lis_from_bsobj(bsobj, lis_type=lis_type)
-
-        with tqdm(desc='process_data_from_bsobj', total=len(lis_list)) as pbar:
-            for li in lis_list:
-                pbar.update(1)
-                try:
-                    li_h4 = li.find('h4')
-                    li_h4_a = li.find('a')
-                    li_h4_sibling_sibling = li_h4.next_sibling.next_sibling
-                    li_img = li.find('img')
-                    li_parent_previous_sibling = li.parent.find_previous_sibling(
-                    )
-                    li_parent_parent_parent_dt = li.parent.parent.parent.dt
-
-                    model_id = li.attrs['id'].replace('s', '')
-                    model_name = li_h4_a.text
-                    model_status = True if li_h4_a.attrs.get(
-                        'class') else False
-                    if hasattr(li_h4_sibling_sibling, 'text'):
-                        model_price = li_h4_sibling_sibling.text
-                    else:
-                        model_price = li_h4_sibling_sibling.__str__()
-                    model_url = self.url_model % model_id
-                    if li_img:
-                        model_picture_url = 'https:%s' % li_img.attrs.get(
-                            'data-original')
-                    else:
-                        model_picture_url = ''
-                    brand_id, manu_id = bm_compile.match(
-                        li_parent_previous_sibling.a['href']).groups()
-                    manu_name = li_parent_previous_sibling.text
-                    brand_name = li_parent_parent_parent_dt.text.strip()
-
-                    data.append([
-                        model_id,
-                        model_name,
-                        model_price,
-                        model_status,
-                        model_url,
-                        model_picture_url,
-                        manu_id,
-                        manu_name,
-                        brand_id,
-                        brand_name,
-                    ])
-                except Exception as e:
-                    self.logger.warning(e)
-        return data
+        return fetch_data_from_bsobj(bsobj,
+                                     lis_type=lis_type,
+                                     logger=self.logger)
 
     def fetch_data_from_selenium(self, driver, response):
         '''
         20220720 改版以后bs4有动态加载问题
         '''
+        # selenium 仅在使用driver时导入
+        from selenium.webdriver.support.wait import WebDriverWait
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
         # response 包含segment_id, segment_name
         driver.maximize_window()
         driver.refresh()
@@ -497,30 +658,10 @@ class Autohome_Model(Async_Spider):
 
         # 预备查询字典
         df_models = self.read_exist_data(False)
-        if self.brand_dict_pkl.exists():
-            with open(self.brand_dict_pkl, 'rb') as f:
-                self.brand_dict = pickle.load(f)
-        else:
-            self.brand_dict = {
-                k: v
-                for k, v in df_models[['brand_id', 'brand_name'
-                                       ]].drop_duplicates().values
-            }
-        if self.manu_dict_pkl.exists():
-            with open(self.manu_dict_pkl, 'rb') as f:
-                self.manu_dict = pickle.load(f)
-        else:
-            self.manu_dict = {
-                k: v
-                for k, v in df_models[['manu_id', 'manu_name'
-                                       ]].drop_duplicates().values
-            }
-
-        self.segment_dict = {
-            k: v
-            for k, v in df_models[['segment_id', 'segment_name'
-                                   ]].drop_duplicates().values
-        }
+        catalog = self.catalog
+        self.brand_dict = catalog.get_dict('brand')
+        self.manu_dict = catalog.get_dict('manu')
+        self.segment_dict = catalog.get_dict('segment')
 
         coroutines = [
             self.async_get_response(self.url_model % model_id,
@@ -531,8 +672,10 @@ class Autohome_Model(Async_Spider):
             coroutines, tqdm_desc='get_df_models_by_url', record=False)
         results = [task.result() for task in tasks]
         responses = [result for result in results if result]
-        datas = [self.fetch_data_by_url_model_from_bsobj(bs4.BeautifulSoup(
-            response.content, features='html5lib')) for response in responses]
+        datas = [
+            self.fetch_data_by_url_model_from_response(response)
+            for response in responses
+        ]
         df_datas = [pd.DataFrame(data, columns=self.result_columns)
                     for data in datas]
 
@@ -553,6 +696,14 @@ class Autohome_Model(Async_Spider):
 
         return df_result
 
+    def fetch_data_by_url_model_from_response(self, response):
+        data = self.fetch_data_by_url_model_from_bsobj(
+            self.make_bsobj(response.content))
+        if data is None and self.parser != 'html5lib':
+            data = self.fetch_data_by_url_model_from_bsobj(
+                self.make_bsobj(response.content, features='html5lib'))
+        return data
+
     def fetch_data_by_url_model_from_bsobj(self, bsobj):
         # 判断停售款
         if self.is_stop_version_from_bsobj(bsobj):
@@ -574,15 +725,12 @@ class Autohome_Model(Async_Spider):
                     'class': 'subnav-title-name'
                 }).text.strip()
                 manu_name = manu[:len(manu) - len(model_name) - 1]
-                manu_id = {v: k
-                           for k, v in self.manu_dict.items()}.get(manu_name)
+                manu_id = self.catalog.get_id('manu', manu_name)
                 brand_name = bsobj.title.text
                 l = brand_name.find('%s_' % model_name)
                 r = brand_name.find('_%s' % model_name)
                 brand_name = brand_name[l + len(model_name) + 1:r]
-                brand_id = {v: k
-                            for k, v in self.brand_dict.items()
-                            }.get(brand_name)
+                brand_id = self.catalog.get_id('brand', brand_name)
                 data = [[
                     model_id,
                     model_name,
@@ -613,9 +761,7 @@ class Autohome_Model(Async_Spider):
                 if m:
                     brand_id = m.groups(1)[0]
                 else:
-                    brand_id = {v: k
-                                for k, v in self.brand_dict.items()
-                                }.get(brand_name)
+                    brand_id = self.catalog.get_id('brand', brand_name)
                 model_name = div.find_all('span')[-1].text.strip()
 
                 price = bsobj.find('dl', {'class': 'information-price'}).dd
@@ -638,14 +784,11 @@ class Autohome_Model(Async_Spider):
                 manu_name = manu_a.text
                 manu_name = manu_a.text[:len(manu_a.text) -
                                         len(manu_a.h1.text) - 2].strip()
-                manu_id = {v: k
-                           for k, v in self.manu_dict.items()}.get(manu_name)
+                manu_id = self.catalog.get_id('manu', manu_name)
                 segment_name = bsobj.find('dd', {
                     'class': 'type'
                 }).span.text.strip()
-                segment_id = {v: k
-                              for k, v in self.segment_dict.items()
-                              }.get(segment_name)
+                segment_id = self.catalog.get_id('segment', segment_name)
 
                 data = [[
                     model_id,
@@ -687,8 +830,11 @@ class Autohome_Model(Async_Spider):
         series_count_dict = {}
         for task in tasks:
             response = task.result()
-            bsobj = bs4.BeautifulSoup(response.content, features='html5lib')
+            bsobj = self.make_bsobj(response.content)
             count = self.fetch_series_count_from_bsobj(bsobj)
+            if count is None and self.parser != 'html5lib':
+                bsobj = self.make_bsobj(response.content, features='html5lib')
+                count = self.fetch_series_count_from_bsobj(bsobj)
             series_count_dict[response.url.__str__()] = count
 
         series_count = pd.DataFrame([[k, v]
@@ -699,56 +845,87 @@ class Autohome_Model(Async_Spider):
         return series_count
 
     def fetch_series_count_from_bsobj(self, bsobj):
-        count = bsobj.select_one('#series-count')
-        if count:
-            result = int(count.text)
-            return result
+        return fetch_series_count_from_bsobj(bsobj)
 
     def fetch_lis_from_bsobj(self, bsobj, lis_type='.rank-list-ul'):
-        # lis_type = '.rank-list-ul' or lis_type = '.rank-img-ul'
-        uls_list = bsobj.select(lis_type)
-        lis_list = []
-        for ul in uls_list:
-            lis_list += ul.select('li')
-        lis_list = [li for li in lis_list if li.attrs.get('id')]
-        return lis_list
+        return fetch_lis_from_bsobj(bsobj, lis_type=lis_type)
 
     def update_brand_manu_dict(self, response, brand_dict, manu_dict):
         # get_df_all_models_by_letter 中更新self.brand_dict, self.manu_dict
-        bsobj = bs4.BeautifulSoup(response.content, features='html5lib')
-        dls = [dl for dl in bsobj.find_all(
-            'dl') if dl.attrs.get('id') and dl.attrs.get('olr')]
-        if len(dls) == 0:
-            return
+        bsobj = self.make_bsobj(response.content)
+        if not self.fetch_brand_manu_dict_from_bsobj(
+                bsobj, brand_dict, manu_dict) and self.parser != 'html5lib':
+            bsobj = self.make_bsobj(response.content, features='html5lib')
+            self.fetch_brand_manu_dict_from_bsobj(bsobj, brand_dict,
+                                                  manu_dict)
+
+    def fetch_brand_manu_dict_from_bsobj(self, bsobj, brand_dict, manu_dict):
+        return fetch_brand_manu_dict_from_bsobj(bsobj, brand_dict, manu_dict)
+
+    def backfill_segment(self, df_models, df_exist):
+        # 按model_id一次merge现有数据, 代替逐行df_vlookup
+        # 未匹配的车型再通过协程获取车型页面
+        self.segment_dict = self.get_segment_dict(df_exist)
+        df_segment = df_exist[['model_id', 'segment_id',
+                               'segment_name']].drop_duplicates(
+                                   subset=['model_id'], keep='first')
+        df_models = df_models.drop(columns=['segment_id', 'segment_name'])
+        df_models = df_models.merge(df_segment, on='model_id', how='left')
+        df_models = df_models[self.result_columns]
+
+        # 判断是否有遗留任务
+        misses = pd.isna(df_models['segment_id'])
+        if misses.any():
+            print('get segment_id of %s models from url_model' % misses.sum())
+            df_models.loc[misses, 'segment_id'] = self.get_segment_ids_by_urls(
+                df_models.loc[misses, 'model_url'].to_list())
+            df_models.loc[misses, 'segment_name'] = df_models.loc[
+                misses, 'segment_id'].map(self.segment_dict)
+        return df_models
 
-        brand_compile = re.compile(r'.*?/brand-(\d*).*?.html.*')
-        manu_compile = re.compile(r'.*?/brand-(\d*)-(\d*).*?.html.*')
+    def get_segment_dict(self, df_exist):
+        # 优先catalog, catalog中没有的id再从df_exist补充
+        # 首次抓取df_exist为空, 新出现的级别也不在df_exist中
+        segment_dict = {
+            k: v
+            for k, v in df_exist[['segment_id', 'segment_name'
+                                  ]].dropna().drop_duplicates().values
+        }
+        segment_dict.update(self.catalog.get_dict('segment'))
+        return segment_dict
 
-        for dl in dls:
-            # 更新brand_dict
-            div_brand = dl.div
-            try:
-                brand_name = div_brand.text
-                brand_id = brand_compile.match(
-                    div_brand.a.attrs['href']).groups()[0]
-                brand_dict |= {brand_id: brand_name}
-            except:
-                pass
-            # 更新manu_dict
-            divs_manu = dl.find_all('div', {'class': 'h3-tit'})
-            for div_manu in divs_manu:
-                try:
-                    manu_name = div_manu.text
-                    manu_id = manu_compile.match(
-                        div_manu.a.attrs['href']).groups()[1]
-                    manu_dict |= {manu_id: manu_name}
-                except:
-                    pass
+    def get_segment_ids_by_urls(self, urls):
+        # 并发数量由self.concurrency控制
+        coroutines = [
+            self.async_get_response(url, max_retry=self.max_retry)
+            for url in urls
+        ]
+        tasks = self.run_async_loop(coroutines,
+                                    tqdm_desc='async_get_segment_id',
+                                    record=False)
+        segment_ids = []
+        for task in tasks:
+            response = task.result()
+            if response:
+                segment_ids.append(
+                    self.get_segment_id_from_response(response))
+            else:
+                segment_ids.append(None)
+        return segment_ids
 
     def get_segment_id_from_url(self, url):
         response = self.session.get(url)
-        bsobj = bs4.BeautifulSoup(
-            response.content, features='html5lib')
+        return self.get_segment_id_from_response(response)
+
+    def get_segment_id_from_response(self, response):
+        segment_id = self.get_segment_id_from_bsobj(
+            self.make_bsobj(response.content))
+        if segment_id is None and self.parser != 'html5lib':
+            segment_id = self.get_segment_id_from_bsobj(
+                self.make_bsobj(response.content, features='html5lib'))
+        return segment_id
+
+    def get_segment_id_from_bsobj(self, bsobj):
         if self.is_stop_version_from_bsobj(bsobj):
             # url_model = 'https://www.autohome.com.cn/4830/'
             try:
@@ -764,9 +941,7 @@ class Autohome_Model(Async_Spider):
                 segment_name = bsobj.find('dd', {
                     'class': 'type'
                 }).span.text.strip()
-                segment_id = {v: k
-                              for k, v in self.segment_dict.items()
-                              }.get(segment_name)
+                segment_id = self.catalog.get_id('segment', segment_name)
                 return segment_id
             except Exception as e:
                 print(e)
@@ -804,9 +979,73 @@ if __name__ == '__main__':
     model_ids = ['4830', '4480']
     df_result = self.get_df_models_by_url_model(model_ids, save=True)
 # %%
+# backfill_segment: df_exist为空时segment_name来自catalog
+if __name__ == '__main__':
+    self = Autohome_Model(verbose=False)
+    segment_dict = self.catalog.get_dict('segment')
+    if not segment_dict:
+        # 没有output数据时在内存中补一个级别
+        segment_dict['a00'] = '微型车'
+    segment_id, segment_name = next(iter(segment_dict.items()))
+    df_models = pd.DataFrame([['1', '车型', None, None, self.url_model % 1,
+                               None, '2', '厂商', '3', '品牌', None, None]],
+                             columns=self.result_columns)
+    df_exist = pd.DataFrame(columns=self.result_columns)
+    # 不请求网络, 车型页面返回的segment_id固定
+    self.get_segment_ids_by_urls = lambda urls: [segment_id] * len(urls)
+    df_result = self.backfill_segment(df_models, df_exist)
+    assert df_result['segment_id'].tolist() == [segment_id]
+    assert df_result['segment_name'].tolist() == [segment_name]
+
+# %%
 # 获取series_count
 if __name__ == '__main__':
     self = Autohome_Model()
     series_count = self.get_series_count()
 
+# %%
+# 解析库一致性检查: self.parser vs html5lib, 页面保存在output/pages
+if __name__ == '__main__':
+    self = Autohome_Model(verbose=False)
+    dirname_pages = self.dirname_output.joinpath('pages')
+    if not dirname_pages.exists():
+        dirname_pages.mkdir()
+    lis_type = '.rank-img-ul'
+    for letter in string.ascii_uppercase:
+        filename = dirname_pages.joinpath('%s_photo.html' % letter)
+        if not filename.exists():
+            filename.write_bytes(
+                self.session.get(self.url_img_by_letter % letter).content)
+        content = filename.read_bytes()
+        t0 = time.perf_counter()
+        data_fast = self.fetch_data_from_bsobj(self.make_bsobj(content),
+                                               lis_type=lis_type)
+        t1 = time.perf_counter()
+        data_html5lib = self.fetch_data_from_bsobj(
+            self.make_bsobj(content, features='html5lib'), lis_type=lis_type)
+        t2 = time.perf_counter()
+        assert data_fast == data_html5lib, letter
+        print('%s: %s rows, %s %.3fs, html5lib %.3fs' %
+              (letter, len(data_fast), self.parser, t1 - t0, t2 - t1))
+
+# %%
+# 进程池解析: 结果与事件循环中解析一致, 页面来自上一个cell
+if __name__ == '__main__':
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    contents = [
+        dirname_pages.joinpath('%s_photo.html' % letter).read_bytes()
+        for letter in string.ascii_uppercase
+    ]
+    func = partial(fetch_page_from_content, lis_type=lis_type)
+    t0 = time.perf_counter()
+    pages_inline = [func(content) for content in contents]
+    t1 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        pages_pool = list(executor.map(func, contents))
+    t2 = time.perf_counter()
+    assert pages_inline == pages_pool
+    print('inline %.3fs, %s workers %.3fs' %
+          (t1 - t0, os.cpu_count(), t2 - t1))
+
 # %%
\ No newline at end of file
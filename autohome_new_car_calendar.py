@@ -6,20 +6,39 @@ import re
 import pandas as pd
 import bs4
 
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
 from async_spider import Async_Spider
+from autohome_spider import Autohome_Spider_Mixin
 
 # mission
 # re 提取 script中的var 
 
 # %%
-class Autohome_New_Car_Calendar(Async_Spider):
+# 模块级解析函数, 可在ProcessPoolExecutor中运行
+def get_date_from_content(content):
+    bsobj = bs4.BeautifulSoup(content, 'lxml')
+    span = bsobj.find('span', {'class': 'time'})
+    if span is not None:
+        date = dttext_to_dt(span.text)
+        return date
+
+
+def dttext_to_dt(dttext):
+    dttext = dttext.strip().split(' ')[0]
+    pattern = re.compile(r'(\d*)年(\d*)月(\d*)日')
+    m = pattern.match(dttext)
+    if m:
+        dt = datetime.date(*[int(x) for x in m.groups()])
+        return dt
+
+
+# %%
+class Autohome_New_Car_Calendar(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_new_car_calendar'
 
-    def __init__(self, max_retry=3, concurrency=100, threading_init_driver=False):
+    def __init__(self, max_retry=3, concurrency=100, threading_init_driver=False, parse_workers=None):
         super().__init__(max_retry=max_retry, concurrency=concurrency, threading_init_driver=threading_init_driver)
+        # parse_workers: 解析进程数, None 在事件循环中解析
+        self.parse_workers = parse_workers
         self.init_preparetion()
 
     def init_preparetion(self):
@@ -280,30 +299,19 @@ class Autohome_New_Car_Calendar(Async_Spider):
             self.async_get_response(url, max_retry=self.max_retry)
             for url in df_remain['url']
         ]
-        tasks = self.run_async_loop(coroutines,
-                                    tqdm_desc='async_get_dates_from_df_remain')
-        responses = [_.result() for _ in tasks]
-        df_date = pd.DataFrame(responses,
-                               columns=['date'],
-                               index=df_remain.index)
-        df_date['date'] = df_date['date'].apply(self.get_date_from_response)
+        dates = self.run_async_pipeline(
+            coroutines,
+            tqdm_desc='async_get_dates_from_df_remain',
+            content_func=get_date_from_content)
+        df_date = pd.DataFrame({'date': dates}, index=df_remain.index)
         return df_date
 
     def get_date_from_response(self, response):
         if response:
-            bsobj = bs4.BeautifulSoup(response.content, 'lxml')
-            span = bsobj.find('span', {'class': 'time'})
-            if span is not None:
-                date = self.dttext_to_dt(span.text)
-                return date
+            return get_date_from_content(response.content)
 
     def dttext_to_dt(self, dttext):
-        dttext = dttext.strip().split(' ')[0]
-        pattern = re.compile(r'(\d*)年(\d*)月(\d*)日')
-        m = pattern.match(dttext)
-        if m:
-            dt = datetime.date(*[int(x) for x in m.groups()])
-            return dt
+        return dttext_to_dt(dttext)
 
     # 获取基础信息, date部分by selenium
     def get_dates_from_df_remain_selenium(self, df_remain_selenium):
@@ -331,6 +339,10 @@ class Autohome_New_Car_Calendar(Async_Spider):
     def get_date_by_selenium(self, url):
         # https://blog.csdn.net/wycaoxin3/article/details/74017971
         # https://blog.csdn.net/sinat_41774836/article/details/88965281
+        # selenium 仅在使用driver时导入
+        from selenium.webdriver.support.wait import WebDriverWait
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
         try:
             self.driver.get(url)
             max_try = self.max_retry
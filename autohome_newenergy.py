@@ -3,9 +3,10 @@ import pandas as pd
 import bs4
 
 from async_spider import Async_Spider
+from autohome_spider import Autohome_Spider_Mixin
 
 # %%
-class Autohome_Newenergy(Async_Spider):
+class Autohome_Newenergy(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_newenergy'
 
     def __init__(self, max_retry=3, concurrency=100, threading_init_driver=False):
@@ -5,16 +5,13 @@ import pickle
 
 import pandas as pd
 
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-
 from async_spider import Async_Spider
-from autohome_model import Autohome_Model
+from autohome_spider import Autohome_Spider_Mixin
+from autohome_context import get_context
 
 
 # %%
-class Autohome_Picture(Async_Spider):
+class Autohome_Picture(Autohome_Spider_Mixin, Async_Spider):
     name = 'autohome_picture'
 
     def __init__(self,
@@ -37,6 +34,10 @@ class Autohome_Picture(Async_Spider):
         self.check_dict_pkl = self.dirname_output.joinpath('check_dict.pkl')
 
     def download_brand_picture(self, force=False):
+        # selenium 仅在使用driver时导入
+        from selenium.webdriver.support.wait import WebDriverWait
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
         # 获取品牌和图片链接
         self.init_driver()
         self.driver.get(self.url_brand)
@@ -83,7 +84,7 @@ class Autohome_Picture(Async_Spider):
                 return df_miss
 
     def download_model_picture(self, force=False, total=None):
-        df_models = Autohome_Model().read_exist_data(False)
+        df_models = get_context(self.dirname_output).df_models
         if total is not None and isinstance(total, int):
             df_models = df_models.head(total)
 
@@ -11,8 +11,8 @@ from itertools import zip_longest
 
 
 from async_spider import Aiohttp_Spider
-from autohome_model import Autohome_Model
-from autohome_dealer import Autohome_Dealer
+from autohome_catalog import get_catalog
+from autohome_context import get_context
 
 
 # %%
@@ -33,18 +33,7 @@ class Autohome_Sale(Aiohttp_Spider):
         self.init_preparetion(group_num, max_update_interval, sleep)
 
     def init_preparetion(self, group_num, max_update_interval, sleep):
-        # 预读信息
-        self.df_models = Autohome_Model(verbose=False).get_df_models(
-            False, False, False)
-        self.model_names = self.df_models['model_name'].to_list()
-        self.df_province_city = Autohome_Dealer().get_df_province_city(
-            False, False)
-        self.province_dict = {
-            k: v
-            for k, v in self.df_province_city[['id_province', 'name_province'
-                                               ]].drop_duplicates().values
-        }
-
+        # df_models, df_province_city 第一次访问时读取
         self.group_num = group_num  # 分组最大数值
         self.sd = '2016-01-01'  # 数据最早从2016年开始
         self.ed = datetime.date(self.today.year, self.today.month,
@@ -58,6 +47,27 @@ class Autohome_Sale(Aiohttp_Spider):
         if not self.dirname_output_sales.exists():
             self.dirname_output_sales.mkdir()
 
+    @property
+    def df_models(self):
+        return get_context(self.dirname_output).df_models
+
+    @property
+    def model_names(self):
+        return self.df_models['model_name'].to_list()
+
+    @property
+    def df_province_city(self):
+        return get_context(self.dirname_output).df_province_city
+
+    @property
+    def province_dict(self):
+        return get_context(self.dirname_output).province_dict
+
+    def ensure_province_city(self):
+        # catalog的province索引由省份城市pkl生成
+        # pkl不存在时由Autohome_Dealer生成并保存, 之后catalog自动重建
+        return get_context(self.dirname_output).df_province_city
+
     def decorater_save_data(func):
         def wrap(self, *args, **kwargs):
             # 读取现有数据
@@ -168,9 +178,9 @@ class Autohome_Sale(Aiohttp_Spider):
         if province_name == '全国':
             province_id = None
         else:
-            province_id = {v: k
-                           for k, v in self.province_dict.items()
-                           }.get(province_name)
+            self.ensure_province_city()
+            province_id = get_catalog(self.dirname_output).get_id(
+                'province', province_name)
         if model_names is None:
             model_names = self.model_names
 
@@ -286,5 +296,6 @@ if __name__ == '__main__':
 
 # %%
 # %%
-results
+if __name__ == '__main__':
+    results
 # %%
@@ -0,0 +1,181 @@
+# %%[markdown]
+# Async_Spider 的通用扩展
+# - run_async_pipeline: 每个response完成后立即解析并释放, 代替run_async_loop后统一解析
+#   同时在内存中的response最多为concurrency个
+#   与run_async_loop使用同一个事件循环, 不每次新建
+#   请求失败的结果为None; 解析出错时记录url和traceback, 全部完成后raise
+# - parse_workers: 解析进程数, 设置后content_func在ProcessPoolExecutor中运行
+#   content_func需为模块级函数, 输入response.content(bytes), 返回list/tuple/dict
+#   parse_workers=None时在事件循环中解析
+# - cache_ttls: {url正则: 秒}, async_get_response和session_get使用output/cache中的缓存
+#   未匹配的url不缓存, 见autohome_cache
+
+# %%
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm.auto import tqdm
+
+from autohome_cache import Response_Cache
+
+
+# %%
+class Autohome_Spider_Mixin:
+    parse_workers = None
+    _parse_executor = None
+    cache_ttls = None
+    _response_cache = None
+
+    @property
+    def response_cache(self):
+        # cache_ttls为空时不使用缓存
+        if self._response_cache is None and self.cache_ttls:
+            self._response_cache = Response_Cache(
+                self.dirname_output.joinpath('cache'), ttls=self.cache_ttls)
+        return self._response_cache
+
+    async def async_get_response(self, url, **kwargs):
+        cache = self.response_cache
+        if cache is None or not cache.is_cacheable(url):
+            return await super().async_get_response(url, **kwargs)
+        meta = kwargs.get('meta')
+        response, entry, headers = cache.get(url, meta=meta)
+        if response is not None:
+            return response
+        if headers:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **headers}
+        response = await super().async_get_response(url, **kwargs)
+        return cache.update(url, entry, response, meta=meta)
+
+    def session_get(self, url, **kwargs):
+        # 带缓存的self.session.get
+        cache = self.response_cache
+        if cache is None or not cache.is_cacheable(url):
+            return self.session.get(url, **kwargs)
+        response, entry, headers = cache.get(url)
+        if response is not None:
+            return response
+        if headers:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **headers}
+        try:
+            response = self.session.get(url, **kwargs)
+        except Exception as e:
+            if entry is None:
+                raise
+            self.logger.warning(e)
+            response = None
+        return cache.update(url, entry, response)
+
+    @property
+    def parse_executor(self):
+        # 第一次使用时创建进程池
+        if self._parse_executor is None and self.parse_workers:
+            self._parse_executor = ProcessPoolExecutor(
+                max_workers=self.parse_workers)
+        return self._parse_executor
+
+    def set_parse_workers(self, parse_workers=None):
+        # parse_workers: 进程数, None 在事件循环中解析
+        self.shutdown_parse_executor()
+        self.parse_workers = parse_workers
+
+    def shutdown_parse_executor(self):
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+
+    def run_async_pipeline(self,
+                           coroutines,
+                           parse_func=None,
+                           tqdm_desc=None,
+                           concurrency=None,
+                           content_func=None):
+        # parse_func(response) -> 解析结果
+        # 有content_func时: parse_func(response, content_func(response.content))
+        #   parse_func为None时直接返回content_func的结果
+        # return 解析结果列表, 与coroutines顺序一致, 请求失败为None
+        loop = self.get_event_loop()
+        return loop.run_until_complete(
+            self.async_pipeline(coroutines,
+                                parse_func,
+                                tqdm_desc=tqdm_desc,
+                                concurrency=concurrency,
+                                content_func=content_func))
+
+    def get_event_loop(self):
+        # 与run_async_loop相同, 使用当前线程的事件循环
+        # loop绑定的session, connector不会跨循环使用
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        try:
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        return loop
+
+    async def async_pipeline(self,
+                             coroutines,
+                             parse_func=None,
+                             tqdm_desc=None,
+                             concurrency=None,
+                             content_func=None):
+        if concurrency is None:
+            concurrency = self.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        results = [None] * len(coroutines)
+        loop = asyncio.get_running_loop()
+        executor = self.parse_executor if content_func else None
+
+        async def parse(response):
+            if content_func is None:
+                return parse_func(response)
+            if executor is None:
+                rows = content_func(response.content)
+            else:
+                # 只传递bytes, 返回纯数据
+                rows = await loop.run_in_executor(executor, content_func,
+                                                  response.content)
+            if parse_func is None:
+                return rows
+            return parse_func(response, rows)
+
+        # 解析出错的(url, exception)
+        parse_errors = []
+
+        with tqdm(desc=tqdm_desc, total=len(coroutines)) as pbar:
+
+            async def run(idx, coroutine):
+                # 解析完成后才释放semaphore, response随之释放
+                async with semaphore:
+                    try:
+                        try:
+                            response = await coroutine
+                        except Exception as e:
+                            # 只有请求失败记为None
+                            self.logger.warning(e)
+                            return
+                        if response is None:
+                            return
+                        try:
+                            results[idx] = await parse(response)
+                        except Exception as e:
+                            url = getattr(response, 'url', None)
+                            self.logger.exception('parse error: %s', url)
+                            parse_errors.append((url, e))
+                    finally:
+                        pbar.update(1)
+
+            await asyncio.gather(
+                *[run(idx, coro) for idx, coro in enumerate(coroutines)])
+        # 解析错误(如页面结构变化)不能当作请求失败, 避免保存不完整的结果
+        if parse_errors:
+            url, e = parse_errors[0]
+            raise RuntimeError('%s of %s responses failed to parse, first: %s'
+                               % (len(parse_errors), len(coroutines),
+                                  url)) from e
+        return results
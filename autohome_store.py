@@ -0,0 +1,251 @@
+# %%[markdown]
+# 分区存储
+# - 每个分区一个pkl: dirname/<key>.pkl, 先写临时文件再os.replace, 中断时不会损坏
+# - manifest.pkl: {key: {'rows': 行数, 'ids': id_column的set, 'time': 保存时间}}
+#   fingerprint=True时另有'fingerprints': {id: 行的sha1}, 用于判断行是否变化
+# - 只写有变化的分区, 读取时只读需要的分区
+# - 写manifest前重新读取, 只修改本次写入的分区
+# - 并发: 写入和manifest更新在锁文件dirname/.lock内进行
+#   调用方的 读取分区 -> 合并 -> write 也需要放在 with store.lock(): 内,
+#   否则同时运行时会丢失对方写入的行
+#   锁文件由O_CREAT|O_EXCL创建, 各平台可用; 持有期间定时更新mtime
+#   超过stale秒未更新的锁视为中断遗留, 删除
+
+# %%
+import os
+import time
+import hashlib
+import pickle
+import pathlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# %%
+def atomic_write(filename, func):
+    # func(tmp_filename) 写入临时文件, 完成后替换filename
+    filename = pathlib.Path(filename)
+    fd, tmp = tempfile.mkstemp(dir=filename.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        func(tmp)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def fingerprint_rows(df, id_column):
+    # return {str(id): sha1}, 由非空的(列名, 值)计算, 与列顺序和其他行无关
+    columns = [str(column) for column in df.columns]
+    fingerprints = {}
+    for row_id, values in zip(df[id_column].astype(str),
+                              df.to_numpy(dtype=object)):
+        items = sorted((column, str(v)) for column, v in zip(columns, values)
+                       if not pd.isna(v))
+        fingerprints[row_id] = hashlib.sha1(
+            repr(items).encode('utf-8')).hexdigest()
+    return fingerprints
+
+
+@contextmanager
+def file_lock(filename, timeout=600, poll=0.1, stale=3600):
+    # 独占锁, timeout秒内拿不到锁时raise TimeoutError
+    t0 = time.time()
+    while True:
+        try:
+            fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(filename).st_mtime > stale:
+                    os.remove(filename)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() - t0 > timeout:
+                raise TimeoutError('lock %s timeout' % filename)
+            time.sleep(poll)
+        else:
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            break
+    # 持有锁期间每stale/4秒更新mtime, 长时间的写入不会被当作遗留锁删除
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(stale / 4):
+            try:
+                os.utime(filename)
+            except FileNotFoundError:
+                break
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        os.remove(filename)
+
+
+class Partitioned_Store:
+    def __init__(self, dirname, id_column='spec_id', fingerprint=False):
+        # id_column: manifest中记录的id列, 用于不读取分区的查询
+        # fingerprint: manifest中记录每行的fingerprint
+        self.dirname = pathlib.Path(dirname)
+        if not self.dirname.exists():
+            self.dirname.mkdir(parents=True)
+        self.id_column = id_column
+        self.fingerprint = fingerprint
+        self.manifest_pkl = self.dirname.joinpath('manifest.pkl')
+        self.lock_filename = self.dirname.joinpath('.lock')
+        # 同一实例内可重入
+        self._lock_depth = 0
+
+    @contextmanager
+    def lock(self):
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with file_lock(self.lock_filename):
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+
+    def get_filename(self, key):
+        return self.dirname.joinpath('%s.pkl' % key)
+
+    def load_manifest(self):
+        if self.manifest_pkl.exists():
+            with open(self.manifest_pkl, 'rb') as f:
+                return pickle.load(f)
+        return {}
+
+    def save_manifest(self, manifest):
+        def dump(tmp):
+            with open(tmp, 'wb') as f:
+                pickle.dump(manifest, f)
+
+        atomic_write(self.manifest_pkl, dump)
+
+    def keys(self):
+        return list(self.load_manifest())
+
+    def get_partition_filenames(self):
+        return [
+            filename for filename in self.dirname.glob('*.pkl')
+            if filename != self.manifest_pkl
+        ]
+
+    def __len__(self):
+        # 分区文件数, 不读取manifest
+        return len(self.get_partition_filenames())
+
+    def get_ids(self, keys=None):
+        # 不读取分区, 返回id_column的set
+        manifest = self.load_manifest()
+        if keys is None:
+            keys = manifest.keys()
+        ids = set()
+        for key in keys:
+            if key in manifest:
+                ids |= manifest[key]['ids']
+        return ids
+
+    def get_fingerprints(self, key, manifest=None):
+        # return {id: fingerprint}, 旧版manifest中没有时由分区计算
+        # manifest: 已读取的manifest, 多个key时只读取一次
+        if manifest is None:
+            manifest = self.load_manifest()
+        entry = manifest.get(key)
+        if entry is None:
+            return {}
+        if 'fingerprints' in entry:
+            return entry['fingerprints']
+        df = self.read_partition(key)
+        if df is None:
+            return {}
+        return fingerprint_rows(df, self.id_column)
+
+    def make_entry(self, df):
+        entry = {
+            'rows': len(df),
+            'ids': set(df[self.id_column].astype(str)),
+            'time': time.time(),
+        }
+        if self.fingerprint:
+            entry['fingerprints'] = fingerprint_rows(df, self.id_column)
+        return entry
+
+    def write(self, dfs):
+        # dfs: {key: df}, 只写入这些分区
+        entries = {key: self.make_entry(df) for key, df in dfs.items()}
+        if not entries:
+            return
+        with self.lock():
+            for key, df in dfs.items():
+                atomic_write(self.get_filename(key), df.to_pickle)
+            manifest = self.load_manifest()
+            manifest.update(entries)
+            self.save_manifest(manifest)
+
+    def read_partition(self, key):
+        filename = self.get_filename(key)
+        if filename.exists():
+            return pd.read_pickle(filename)
+
+    def read(self, keys=None):
+        # keys为None时读取全部分区
+        if keys is None:
+            keys = self.keys()
+        dfs = [self.read_partition(key) for key in keys]
+        dfs = [df for df in dfs if df is not None]
+        if len(dfs):
+            return pd.concat(dfs, ignore_index=True)
+        return pd.DataFrame()
+
+    def delete(self, keys):
+        with self.lock():
+            manifest = self.load_manifest()
+            for key in keys:
+                filename = self.get_filename(key)
+                if filename.exists():
+                    filename.unlink()
+                manifest.pop(key, None)
+            self.save_manifest(manifest)
+
+    def rebuild_manifest(self):
+        # manifest丢失或与分区文件不一致时, 读取所有分区重建
+        with self.lock():
+            manifest = {}
+            for filename in self.get_partition_filenames():
+                manifest[filename.stem] = self.make_entry(
+                    pd.read_pickle(filename))
+            self.save_manifest(manifest)
+        return manifest
+
+    def migrate(self, df, key_column):
+        # 由整体保存的df按key_column拆分成分区
+        self.write({
+            str(key): df_key.reset_index(drop=True)
+            for key, df_key in df.groupby(df[key_column].astype(str),
+                                          sort=False)
+        })
+
+
+# %%
+if __name__ == '__main__':
+    self = Partitioned_Store('output/configuration',
+                             id_column=('spec_id', '', '', ''))
+    print(len(self), len(self.get_ids()))
+# %%
@@ -1,10 +1,20 @@
 # %%
 import base64
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from baidu_aksk import baidu_api_key, baidu_secret_key
 # %%
 class Baidu_ORC:
-    def __init__(self):
+    # 图片限制: 最长边不超过4096px, base64后不超过4M
+    max_side = 4096
+
+    def __init__(self, max_workers=4):
+        # max_workers: general_basic_batch 同时请求数, 共用一个连接池
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
         self.access_token = self.get_access_token()
         # '24.78ec14cfb4796c3416b9e7232c547e86.2592000.1659110746.282335-26575674'
 
@@ -14,7 +24,7 @@ class Baidu_ORC:
         url = 'https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={client_id}&client_secret={client_secret}'.format(
             client_id=api_key, client_secret=secret_key)
         try:
-            response = requests.get(url)
+            response = self.session.get(url)
             data = response.json()
             access_token = data['access_token']
             return access_token
@@ -23,18 +33,33 @@ class Baidu_ORC:
 
     def general_basic(self, filename):
         # 通用文字识别
+        with open(filename, 'rb') as f:
+            return self.general_basic_bytes(f.read())
+
+    def general_basic_bytes(self, content):
+        # content: 图片的bytes, 不需要写入文件
         # url = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"
         url = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic?access_token={access_token}".format(
             access_token=self.access_token)
-        with open(filename, 'rb') as f:
-            im = base64.b64encode(f.read())
+        im = base64.b64encode(content)
         params = {"image": im}
         # access_token = '[调用鉴权接口获取的token]'
         headers = {'content-type': 'application/x-www-form-urlencoded'}
-        response = requests.post(url, data=params, headers=headers)
+        response = self.session.post(url, data=params, headers=headers)
         if response:
             result = response.json()
             return result
+
+    def general_basic_batch(self, contents):
+        # 并发识别多张图片, 结果与contents顺序相同, 失败为None
+        def general_basic_bytes(content):
+            try:
+                return self.general_basic_bytes(content)
+            except Exception as e:
+                print(e)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(general_basic_bytes, contents))
 # %%
 if __name__ == '__main__':
     bo = Baidu_ORC()